@@ -0,0 +1,80 @@
+"""比较两次基准测试的结果
+
+    python benchmarks/compare.py old.json new.json [--threshold 10]
+
+延迟上升（或吞吐量下降）超过 threshold 百分比的接口标记为回退，
+存在回退时以状态码 1 退出，便于在 CI 中使用。
+"""
+import argparse
+import json
+import sys
+
+METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'peak_memory_kb']
+HIGHER_IS_BETTER = {'throughput_rps'}
+
+
+def change(old, new):
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+
+def compare(old, new, threshold):
+    regressions = []
+    for rows, dataset in new['datasets'].items():
+        base = old['datasets'].get(rows)
+        if base is None:
+            continue
+        print('%s rows (%s -> %s)' % (rows, old['commit'], new['commit']))
+        for name, stats in dataset['endpoints'].items():
+            before = base['endpoints'].get(name)
+            if before is None:
+                continue
+            cells = []
+            for metric in METRICS:
+                delta = change(before[metric], stats[metric])
+                worse = -delta if metric in HIGHER_IS_BETTER else delta
+                flag = '!' if worse > threshold else ' '
+                if flag == '!':
+                    regressions.append((rows, name, metric, delta))
+                cells.append('%s %+7.1f%%%s' % (metric, delta, flag))
+            print('  %-18s %s' % (name, '  '.join(cells)))
+    return regressions + compare_startup(old.get('startup'), new.get('startup'), threshold)
+
+
+def compare_startup(old, new, threshold):
+    # 冷启动的各项耗时，越小越好
+    if not old or not new:
+        return []
+    regressions, cells = [], []
+    for metric in sorted(name for name in new if name.endswith('_ms') and name in old):
+        delta = change(old[metric], new[metric])
+        flag = '!' if delta > threshold else ' '
+        if flag == '!':
+            regressions.append(('startup', 'startup', metric, delta))
+        cells.append('%s %+7.1f%%%s' % (metric, delta, flag))
+    print('startup  %s' % '  '.join(cells))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed slowdown in percent')
+    args = parser.parse_args(argv)
+
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print('%d regressions over %.0f%%.' % (len(regressions), args.threshold))
+        return 1
+    print('No regressions.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
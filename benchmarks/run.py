@@ -0,0 +1,223 @@
+"""Watchlist 性能基准测试
+
+用 Faker 生成不同规模的数据，通过 app.test_client() 调用各个接口，
+统计每个接口的 p50/p95/p99 延迟、吞吐量和峰值内存，结果保存为 JSON。
+另外在新进程中测量冷启动：导入、create_app()、第一个请求和一次命令行调用的耗时。
+
+    python benchmarks/run.py --rows 10000 100000 1000000
+    python benchmarks/compare.py benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 基准测试会清空数据库，总是使用单独的数据库文件，不影响 data.db
+os.environ['DATABASE_FILE'] = os.getenv('BENCHMARK_DATABASE_FILE',
+                                        os.path.join(tempfile.mkdtemp(), 'benchmark.db'))
+
+from watchlist import create_app, db  # noqa: E402
+from watchlist.cache import page_cache  # noqa: E402
+from watchlist.models import User  # noqa: E402
+from watchlist.profiles import profile_cache  # noqa: E402
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+app = create_app()
+
+# 在新的解释器中执行，输出各阶段的耗时（毫秒）
+STARTUP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import watchlist
+imported = time.perf_counter()
+app = watchlist.create_app()
+created = time.perf_counter()
+app.test_client().get('/')
+finished = time.perf_counter()
+print(json.dumps(dict(import_ms=(imported - start) * 1000, create_app_ms=(created - imported) * 1000,
+                      first_request_ms=(finished - created) * 1000)))
+'''
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def seed(rows):
+    # 重建数据库并生成 rows 条数据
+    page_cache.clear()
+    profile_cache.invalidate()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    runner = app.test_cli_runner()
+    start = time.perf_counter()
+    result = runner.invoke(args=['forge', '--count', str(max(rows - 23, 0)), '--seed', '42'])
+    if result.exit_code != 0:
+        raise RuntimeError(result.output)
+    seconds = time.perf_counter() - start
+    with app.app_context():
+        user = User.query.first()
+        user.username = USERNAME
+        user.set_password(PASSWORD)
+        db.session.commit()
+    return seconds
+
+
+def login(client):
+    client.post('/login', data=dict(username=USERNAME, password=PASSWORD))
+
+
+class Endpoint:
+    # 一个被测接口：name 为结果中的名字，call(client, i) 发起第 i 次请求
+
+    def __init__(self, name, call, logged_in=False, cache=True, repeat=None):
+        self.name = name
+        self.call = call
+        self.logged_in = logged_in
+        self.cache = cache
+        self.repeat = repeat    # 覆盖默认的请求次数（例如密码散列很慢的登录）
+
+
+def endpoints(rows):
+    middle = rows // 2
+    return [
+        Endpoint('index', lambda c, i: c.get('/')),
+        Endpoint('index_uncached', lambda c, i: c.get('/'), cache=False),
+        Endpoint('index_deep_page', lambda c, i: c.get('/?after=%d' % (middle + i)), cache=False),
+        Endpoint('index_logged_in', lambda c, i: c.get('/'), logged_in=True),
+        Endpoint('search', lambda c, i: c.get('/search?q=the'), cache=False),
+        Endpoint('api_list', lambda c, i: c.get('/api/v1/movies'), cache=False),
+        Endpoint('login', lambda c, i: c.post('/login', data=dict(username=USERNAME, password=PASSWORD)),
+                 repeat=10),
+        Endpoint('add', lambda c, i: c.post('/', data=dict(title='Bench %d' % i, year='2000')),
+                 logged_in=True),
+        Endpoint('edit', lambda c, i: c.post('/movie/edit/%d' % (middle + i),
+                                             data=dict(title='Edited %d' % i, year='2001')),
+                 logged_in=True),
+        Endpoint('delete', lambda c, i: c.post('/movie/delete/%d' % (middle + 1000 + i)),
+                 logged_in=True),
+    ]
+
+
+def measure(endpoint, requests):
+    client = app.test_client()
+    if endpoint.logged_in:
+        login(client)
+    app.config['WATCHLIST_CACHE_ENABLED'] = endpoint.cache
+    n = endpoint.repeat or requests
+    try:
+        endpoint.call(client, -1)    # 预热
+        gc.collect()
+        latencies = []
+        start = time.perf_counter()
+        for i in range(n):
+            t = time.perf_counter()
+            response = endpoint.call(client, i)
+            latencies.append((time.perf_counter() - t) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError('%s returned %d' % (endpoint.name, response.status_code))
+        total = time.perf_counter() - start
+
+        # 单独测量峰值内存，tracemalloc 会拖慢请求，不和延迟一起统计
+        tracemalloc.start()
+        for i in range(n, n + min(n, 5)):
+            endpoint.call(client, i)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        app.config['WATCHLIST_CACHE_ENABLED'] = True
+
+    return dict(
+        requests=n,
+        p50_ms=round(percentile(latencies, 50), 3),
+        p95_ms=round(percentile(latencies, 95), 3),
+        p99_ms=round(percentile(latencies, 99), 3),
+        throughput_rps=round(n / total, 1),
+        peak_memory_kb=round(peak / 1024, 1),
+    )
+
+
+def measure_startup(runs):
+    # 每次都启动新的进程，取中位数；cli_ms 是一次 flask 命令（列出路由）的总耗时
+    env = dict(os.environ, FLASK_APP='watchlist', PYTHONPATH=ROOT)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT, env=env)
+        sample = json.loads(output.decode().strip().splitlines()[-1])
+        start = time.perf_counter()
+        subprocess.check_output([sys.executable, '-m', 'flask', 'routes'], cwd=ROOT, env=env)
+        sample['cli_ms'] = (time.perf_counter() - start) * 1000
+        samples.append(sample)
+    return dict({name: round(percentile([sample[name] for sample in samples], 50), 1)
+                 for name in samples[0]}, runs=runs)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run watchlist benchmarks.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help='dataset sizes to benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--only', nargs='+', help='only run these endpoints')
+    parser.add_argument('--startup-runs', type=int, default=5, help='processes started for the startup benchmark')
+    parser.add_argument('--output', help='result file (default benchmarks/results/<commit>.json)')
+    args = parser.parse_args(argv)
+
+    app.config['TESTING'] = True
+    app.config['WATCHLIST_LOGIN_PER_MINUTE'] = 0    # 登录接口要反复测量，不限流
+    commit = git_commit()
+    results = dict(commit=commit, python=platform.python_version(),
+                   date=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                   requests=args.requests, datasets={})
+
+    for rows in args.rows:
+        print('Seeding %d rows...' % rows, flush=True)
+        dataset = dict(seed_seconds=round(seed(rows), 2), endpoints={})
+        for endpoint in endpoints(rows):
+            if args.only and endpoint.name not in args.only:
+                continue
+            stats = measure(endpoint, args.requests)
+            dataset['endpoints'][endpoint.name] = stats
+            print('  %-18s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %8.1f req/s  peak %8.1f KiB' % (
+                endpoint.name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['throughput_rps'], stats['peak_memory_kb']), flush=True)
+        results['datasets'][str(rows)] = dataset
+
+    if not args.only or 'startup' in args.only:
+        stats = measure_startup(args.startup_runs)
+        results['startup'] = stats
+        print('Startup: import %.1fms  create_app %.1fms  first request %.1fms  cli %.1fms' % (
+            stats['import_ms'], stats['create_app_ms'], stats['first_request_ms'], stats['cli_ms']), flush=True)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', '%s.json' % commit)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('Saved results to %s' % output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,40 @@
+import gzip
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from watchlist import app, db
-from watchlist.models import Movie, User
+from contextlib import contextmanager
+
+# 测试使用临时数据库文件，避免清空仓库中的 data.db
+os.environ['DATABASE_FILE'] = os.path.join(tempfile.mkdtemp(), 'test.db')
+
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from watchlist import create_app, db
+from watchlist.models import Movie, User, contains_cjk, normalize_title
+from watchlist.cache import page_cache, bump_version
+from watchlist.profiles import profile_cache
+from watchlist.stats import stats_cache
+from watchlist.facets import SORTS, parse_filters, sorted_statement
+from watchlist.pagination import encode_cursor
+from watchlist.metrics import registry
+from watchlist.ratelimit import login_limiter
+from watchlist.enrich import Provider, StaticProvider
+from watchlist.jobs import runner
+from watchlist import assets
 from watchlist.commands import forge, initdb
 
+app = create_app()
+
 
 class WatchlistTestCase(unittest.TestCase):
     # 测试Flask程序
@@ -10,14 +42,26 @@ class WatchlistTestCase(unittest.TestCase):
         # 更新配置
         app.config.update(
             TESTING=True,    # 开启测试模式
-            SQLAICHEMY_DATABASE_URI='sqlite:///:memory:'
+            WATCHLIST_PASSWORD_METHOD='pbkdf2:sha256:1000',    # 测试中使用很快的散列
+            WATCHLIST_LOGIN_PER_MINUTE=10,
+            WATCHLIST_LOGIN_BURST=10,
+            WATCHLIST_JOB_WORKERS=0,    # 后台任务由测试调用 flask jobs work 执行
+            WATCHLIST_JOB_RETRY_DELAY=30,
+            WATCHLIST_ENRICH_PROVIDER='',
         )
+        self.context = app.app_context()    # 推送程序上下文
+        self.context.push()
+        page_cache.clear()    # 每个测试使用干净的页面缓存
+        stats_cache.clear()
+        profile_cache.invalidate()
+        registry.reset()
+        login_limiter.reset()
         # 创建数据库和表
         db.create_all()
         # 创建测试数据，一个用户，一个电影条目
         user = User(name='Test', username='test')
         user.set_password('123')
-        movie = Movie(title='Test Movie Title', year='2019')
+        movie = Movie(title='Test Movie Title', year='2019', user=user)
         # 使用 add_all() 方法一次添加多个模型类实例，传入列表
         db.session.add_all([user, movie])
         db.session.commit()
@@ -28,6 +72,7 @@ class WatchlistTestCase(unittest.TestCase):
     def tearDown(self):
         db.session.remove()    # 清除数据库对话
         db.drop_all()    # 删除数据库表
+        self.context.pop()
 
     # 测试程序实例是否存在
     def test_app_exist(self):
@@ -37,14 +82,28 @@ class WatchlistTestCase(unittest.TestCase):
     def test_app_is_testing(self):
         self.assertTrue(app.config['TESTING'])
 
+    # 测试应用工厂：配置可以覆盖，Web 进程不加载命令行模块
+    def test_create_app(self):
+        other = create_app(dict(WATCHLIST_PER_PAGE=5, WATCHLIST_SQLITE_PRAGMAS=dict(busy_timeout=1500)))
+        self.assertEqual(other.config['WATCHLIST_PER_PAGE'], 5)
+        self.assertEqual(other.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args']['timeout'], 1.5)
+        self.assertIsInstance(create_app(dict(WATCHLIST_PROXY_COUNT=1)).wsgi_app, ProxyFix)
+        self.assertIn('main.index', other.view_functions)
+        code = ('import sys, watchlist; assert "watchlist.views" not in sys.modules; '
+                'app = watchlist.create_app(); app.test_client().get("/nothing"); '
+                'print("watchlist.commands" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.decode().strip(), 'False')
+        self.assertIn('forge', self.runner.invoke(args=['--help']).output)
+
     # 测试客户端
     # 测试404页面
 
     def test_404_page(self):
         response = self.client.get('/nothing')    # 传入目标 URL
         data = response.get_data(as_text=True)
-        self.assertIn('Page Not Fount - 404', data)
-        self.assertIn('Go back', data)
+        self.assertIn('Page Not Found - 404', data)
+        self.assertIn('Go Back', data)
         self.assertEqual(response.status_code, 404)    # 判断响应状态码
 
     # 测试主页
@@ -55,6 +114,348 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertIn('Test Movie Title', data)
         self.assertEqual(response.status_code, 200)
 
+    # 测试主页分页
+    def test_index_pagination(self):
+        db.session.add_all([Movie(title='Movie %d' % i, year='2000', user_id=1) for i in range(5)])
+        db.session.commit()
+
+        response = self.client.get('/?limit=2')
+        data = response.get_data(as_text=True)
+        self.assertIn('6 Titles', data)
+        self.assertIn('Test Movie Title', data)
+        self.assertIn('Movie 0', data)
+        self.assertNotIn('Movie 1', data)
+        self.assertIn('after=2', data)
+        self.assertNotIn('Prev', data)
+
+        response = self.client.get('/?after=2&limit=2')
+        data = response.get_data(as_text=True)
+        self.assertIn('Movie 2', data)
+        self.assertNotIn('Movie 0', data)
+        self.assertIn('before=3', data)
+        self.assertIn('after=4', data)
+
+        response = self.client.get('/?before=3&limit=2')
+        data = response.get_data(as_text=True)
+        self.assertIn('Test Movie Title', data)
+        self.assertIn('Movie 0', data)
+        self.assertNotIn('Movie 2', data)
+
+    # 测试流式渲染主页
+    def test_index_stream(self):
+        db.session.add_all([Movie(title='Movie %d' % i, year=2000, user_id=1) for i in range(120)])
+        db.session.commit()
+        app.config['WATCHLIST_STREAM_BATCH_SIZE'] = 50
+        app.config['WATCHLIST_STREAM_CHUNK_SIZE'] = 1024
+        try:
+            response = self.client.get('/?stream=1&limit=10')
+            self.assertTrue(response.is_streamed)
+            chunks = list(response.response)
+        finally:
+            app.config['WATCHLIST_STREAM_BATCH_SIZE'] = 500
+            app.config['WATCHLIST_STREAM_CHUNK_SIZE'] = 16 * 1024
+        self.assertGreater(len(chunks), 1)
+        data = b''.join(chunks).decode('utf-8')
+        self.assertIn('121 Titles', data)
+        self.assertIn('Test Movie Title', data)
+        self.assertIn('Movie 119', data)    # 不分页
+        self.assertNotIn('Next', data)
+        self.assertNotIn('X-Cache', response.headers)
+
+        data = self.client.get('/?stream=1&after=100').get_data(as_text=True)
+        self.assertNotIn('Movie 98', data)
+        self.assertIn('Movie 99', data)
+
+    # 测试主页缓存
+    def test_index_cache(self):
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertIn('Test Movie Title', response.get_data(as_text=True))
+        self.assertEqual(self.client.get('/cache/stats').json['hits'], 1)
+
+        # 登录用户的页面单独缓存
+        self.login()
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertIn('Delete', response.get_data(as_text=True))
+
+        # 写操作会使缓存失效
+        self.client.post('/movie/edit/1', data=dict(title='Cached Title', year='2019'))
+        self.client.get('/')    # 显示闪现消息，不使用缓存
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertIn('Cached Title', response.get_data(as_text=True))
+
+    def test_index_cache_stale_profile(self):
+        self.client.get('/')
+        # 其他进程修改了名字：本进程缓存的资料还没过期，但版本号已经变了
+        db.session.get(User, 1).name = 'Grey Li'
+        bump_version(1)
+        db.session.commit()
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        # 用旧资料渲染的页面没有放进缓存，下一个请求重新加载资料
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertIn('Grey Li\'s Watchlist', response.get_data(as_text=True))
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertIn('Grey Li\'s Watchlist', response.get_data(as_text=True))
+
+    # 测试搜索
+    def test_search(self):
+        db.session.add_all([Movie(title='流浪地球2', year=2023, user_id=1), Movie(title='战狼', year=2015, user_id=1),
+                            Movie(title='My Neighbor Totoro', year=1988, user_id=1)])
+        db.session.commit()
+
+        data = self.client.get('/search?q=neighbor').get_data(as_text=True)
+        self.assertIn('My Neighbor Totoro', data)
+        self.assertNotIn('Test Movie Title', data)
+
+        data = self.client.get('/search?q=流浪地').get_data(as_text=True)
+        self.assertIn('流浪地球2', data)
+
+        data = self.client.get('/search?q=战狼').get_data(as_text=True)    # 少于三个字符
+        self.assertIn('战狼', data)
+        self.assertNotIn('流浪地球2', data)
+
+        # 翻页链接保留每页条数
+        data = self.client.get('/search?q=o&limit=1').get_data(as_text=True)
+        self.assertIn('limit=1', data)
+        self.assertIn('page=2', data)
+        self.assertEqual(self.client.get('/search?q=o&page=%d' % 2 ** 62).status_code, 400)
+
+        # 修改和删除后索引保持同步
+        movie = Movie.query.filter_by(title='My Neighbor Totoro').first()
+        movie.title = 'Spirited Away'
+        db.session.commit()
+        data = self.client.get('/search?q=neighbor').get_data(as_text=True)
+        self.assertIn('No titles found.', data)
+        db.session.delete(movie)
+        db.session.commit()
+        data = self.client.get('/search?q=spirited').get_data(as_text=True)
+        self.assertIn('No titles found.', data)
+
+    # 测试回填全文索引
+    def test_index_search_command(self):
+        db.session.add_all([Movie(title='Movie %d' % i, year=2000, user_id=1) for i in range(4)])
+        db.session.add(Movie(title='流浪地球', year=2019, user_id=1))
+        db.session.commit()
+        db.session.execute(db.text("INSERT INTO movie_fts (movie_fts) VALUES ('delete-all')"))
+        db.session.commit()
+        self.assertIn('No titles found.', self.client.get('/search?q=movie').get_data(as_text=True))
+
+        result = self.runner.invoke(args=['index-search', '--batch-size', '2'])
+        self.assertIn('Indexed 6 titles.', result.output)
+        self.assertIn('Test Movie Title', self.client.get('/search?q=movie').get_data(as_text=True))
+        self.assertIn('流浪地球', self.client.get('/search?q=流浪地').get_data(as_text=True))    # 最后一批
+
+    # 测试 API 读取和条件请求
+    def test_api_read(self):
+        response = self.client.get('/api/v1/movies')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['items'], [dict(id=1, title='Test Movie Title', year=2019, is_read=False)])
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        response = self.client.get('/api/v1/movies', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get('/api/v1/movies/1')
+        self.assertEqual(response.json['title'], 'Test Movie Title')
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.client.get('/api/v1/movies/2').status_code, 404)
+
+        self.assertEqual(self.client.get('/api/v1/movies?is_read=true').json['items'], [])
+        self.assertEqual(len(self.client.get('/api/v1/movies?year=2019').json['items']), 1)
+        self.assertEqual(self.client.get('/api/v1/movies?is_read=maybe').status_code, 400)
+
+        # 修改后 ETag 失效
+        self.login()
+        self.client.patch('/api/v1/movies/1', json=dict(is_read=True))
+        response = self.client.get('/api/v1/movies', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        # 同一秒内的修改：If-Modified-Since 等于 Last-Modified 时视为已修改
+        response = self.client.get('/api/v1/movies', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/movies', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 304)
+        # If-None-Match 优先于 If-Modified-Since
+        response = self.client.get('/api/v1/movies', headers={
+            'If-None-Match': etag, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['items'][0]['is_read'])
+
+    # 测试 API 写操作
+    def test_api_write(self):
+        response = self.client.post('/api/v1/movies', json=dict(title='Leon', year=1994))
+        self.assertEqual(response.status_code, 401)
+
+        self.login()
+        response = self.client.post('/api/v1/movies', json=dict(title='Leon', year=1994))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers['Location'], '/api/v1/movies/2')
+        self.assertEqual(response.json, dict(id=2, title='Leon', year=1994, is_read=False))
+        self.assertEqual(self.client.post('/api/v1/movies', json=dict(title='', year=1994)).status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/movies', json=dict(title='Leon', year='19x4')).status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/movies', json=dict(title='Leon', year='199²')).status_code, 400)
+
+        response = self.client.put('/api/v1/movies/2', json=dict(title='Léon', year='1994', is_read='yes'))
+        self.assertEqual(response.json, dict(id=2, title='Léon', year=1994, is_read=True))
+        self.assertEqual(self.client.patch('/api/v1/movies/2', json=dict(year=12345)).status_code, 400)
+
+        self.assertEqual(self.client.delete('/api/v1/movies/2').status_code, 204)
+        self.assertEqual(self.client.delete('/api/v1/movies/2').status_code, 404)
+        self.assertEqual(Movie.query.count(), 1)
+
+    # 测试标题文字分类和外部链接
+    def test_external_link(self):
+        self.assertFalse(contains_cjk('WALL-E'))
+        self.assertFalse(contains_cjk('Léon'))
+        self.assertTrue(contains_cjk('流浪地球2'))
+        self.assertTrue(contains_cjk('千と千尋の神隠し'))
+        self.assertTrue(contains_cjk('기생충'))
+        self.assertTrue(contains_cjk('\U00020000'))    # 扩展 B 区
+
+        db.session.add(Movie(title='蜘蛛侠:纵横宇宙', year=2023, user_id=1))
+        db.session.commit()
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('https://www.imdb.com/find?q=Test%20Movie%20Title', data)
+        self.assertIn('https://movie.douban.com/subject_search?search_text='
+                      '%E8%9C%98%E8%9B%9B%E4%BE%A0%3A%E7%BA%B5%E6%A8%AA%E5%AE%87%E5%AE%99', data)
+
+    # 测试请求统计
+    def test_metrics(self):
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/nothing')
+        data = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('watchlist_request_duration_seconds_count{endpoint="main.index"} 2', data)
+        self.assertIn('watchlist_responses_total{endpoint="unmatched",status="404"} 1', data)
+        self.assertIn('watchlist_sql_queries_total{endpoint="main.index"} 7', data)    # 第二次命中缓存，只查询版本号
+        self.assertRegex(data, r'watchlist_template_render_seconds_total\{endpoint="main.index"\} 0\.\d+')
+        self.assertRegex(data, r'watchlist_response_bytes_total\{endpoint="main.index"\} \d+')
+        self.assertIn('watchlist_page_cache_hits_total 1', data)
+
+    # 测试慢请求日志
+    def test_slow_request_log(self):
+        app.config['WATCHLIST_SLOW_REQUEST_MS'] = 0.001
+        try:
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                self.client.get('/')
+        finally:
+            app.config['WATCHLIST_SLOW_REQUEST_MS'] = 0
+        self.assertIn('Slow request GET /?', logs.output[0])
+        self.assertIn('FROM movie', logs.output[0])
+
+    # 测试 WAL 模式下读请求不会被写事务阻塞
+    def test_readers_not_blocked_by_writer(self):
+        self.assertEqual(db.session.execute(db.text('PRAGMA journal_mode')).scalar(), 'wal')
+        db.session.remove()
+
+        locked = threading.Event()
+        release = threading.Event()
+
+        def writer():
+            conn = sqlite3.connect(os.environ['DATABASE_FILE'], isolation_level=None)
+            conn.execute('BEGIN EXCLUSIVE')    # 回滚日志模式下会阻塞所有读操作
+            conn.execute("UPDATE movie SET title = 'Uncommitted'")
+            locked.set()
+            release.wait(5)
+            conn.execute('ROLLBACK')
+            conn.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            locked.wait(5)
+            start = time.perf_counter()
+            data = self.client.get('/').get_data(as_text=True)
+            elapsed = time.perf_counter() - start
+        finally:
+            release.set()
+            thread.join()
+        self.assertLess(elapsed, 1)
+        self.assertIn('Test Movie Title', data)
+        self.assertNotIn('Uncommitted', data)
+
+    # 辅助方法，统计执行的 SQL 语句数量
+    @contextmanager
+    def count_queries(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    # 测试每个用户有自己的清单
+    def test_per_user_lists(self):
+        other = User(name='Other', username='other')
+        other.set_password('456')
+        db.session.add(other)
+        db.session.add(Movie(title='Other Movie', year=2000, user=other))
+        db.session.commit()
+
+        # 访客看到第一个用户的清单
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('Test Movie Title', data)
+        self.assertNotIn('Other Movie', data)
+
+        # 登录后只能看到和修改自己的电影
+        self.client.post('/login', data=dict(username='other', password='456'))
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('Other Movie', data)
+        self.assertNotIn('Test Movie Title', data)
+        self.assertEqual([m['title'] for m in self.client.get('/api/v1/movies').json['items']], ['Other Movie'])
+        self.assertNotIn('Test Movie Title', self.client.get('/search?q=movie').get_data(as_text=True))
+        self.assertEqual(self.client.get('/movie/edit/1').status_code, 404)
+        self.assertEqual(self.client.post('/movie/delete/1').status_code, 404)
+        self.assertEqual(self.client.delete('/api/v1/movies/1').status_code, 404)
+        self.client.post('/', data=dict(title='Mine', year='2001'))
+        self.assertEqual(Movie.query.filter_by(title='Mine').one().user_id, other.id)
+
+        # 列表查询使用以 user_id 开头的索引
+        plan = db.session.execute(db.text(
+            'EXPLAIN QUERY PLAN SELECT * FROM movie WHERE user_id = 2 ORDER BY id LIMIT 50')).all()
+        self.assertIn('ix_movie_user_id', ' '.join(row[-1] for row in plan))
+
+    # 测试用户资料缓存，页面公共部分不查询数据库
+    def test_user_profile_queries(self):
+        self.client.get('/login')    # 预热缓存
+        with self.count_queries() as statements:
+            self.client.get('/login')
+            self.client.get('/nothing')
+        self.assertEqual(statements, [])
+
+        self.login()
+        self.client.get('/settings')
+        with self.count_queries() as statements:
+            data = self.client.get('/settings').get_data(as_text=True)
+        self.assertEqual(statements, [])
+        self.assertIn('value="Test"', data)
+
+        # 修改名字后缓存失效
+        self.client.post('/settings', data=dict(name='Grey Li'))
+        data = self.client.get('/settings').get_data(as_text=True)
+        self.assertIn('Grey Li\'s Watchlist', data)
+        self.assertIn('value="Grey Li"', data)
+
+        # 缓存的用户数有上限，最久没有使用的先被移除
+        maxsize = profile_cache.maxsize
+        self.addCleanup(setattr, profile_cache, 'maxsize', maxsize)
+        profile_cache.maxsize = 2
+        for key in range(5):
+            profile_cache.get(key, lambda: key)
+        self.assertEqual(len(profile_cache), 2)
+
     # 辅助方法，用于登录用户
     def login(self):
         self.client.post('/login', data=dict(
@@ -141,6 +542,175 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertIn('Item deleted.', data)
         self.assertNotIn('Test Movie Title', data)
 
+    # 测试批量操作
+    def test_bulk_actions(self):
+        db.session.add_all([Movie(title='Movie %d' % i, year=2000, user_id=1) for i in range(4)])
+        db.session.commit()
+        self.assertEqual(self.client.post('/movie/bulk', data=dict(action='read', ids=[1])).status_code, 302)
+        self.assertFalse(db.session.get(Movie, 1).is_read)
+
+        self.login()
+        self.assertIn('name="ids" value="2"', self.client.get('/').get_data(as_text=True))
+        with self.count_queries() as statements:
+            response = self.client.post('/movie/bulk', data=dict(action='read', ids=['1', '2', '3']),
+                                        follow_redirects=True)
+        self.assertIn('3 items updated.', response.get_data(as_text=True))
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE movie')]), 1)
+        db.session.expire_all()
+        self.assertEqual([m.is_read for m in Movie.query.order_by(Movie.id)], [True, True, True, False, False])
+        response = self.client.post('/movie/bulk', data=dict(action='drop', ids=['1']), follow_redirects=True)
+        self.assertIn('Invalid input.', response.get_data(as_text=True))
+
+        response = self.client.post('/api/v1/movies/bulk', json=dict(action='delete', ids=[1, 2, 99]))
+        self.assertEqual(response.json, dict(action='delete', count=2))
+        self.assertEqual(self.client.post('/api/v1/movies/bulk', json=dict(action='unread', ids='1')).status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/movies/bulk', json=dict(action='unread', ids=[2 ** 63])).status_code, 400)
+        self.assertEqual(Movie.query.count(), 3)
+        self.assertNotIn('Test Movie Title', self.client.get('/search?q=movie').get_data(as_text=True))
+
+    # 测试增量同步的变更序号和墓碑
+    def test_change_feed(self):
+        response = self.client.get('/api/v1/changes')
+        self.assertEqual([(item['op'], item['movie']['title']) for item in response.json['items']],
+                         [('upsert', 'Test Movie Title')])
+        movie = response.json['items'][0]['movie']
+        self.assertTrue(movie['created_at'].endswith('Z'))
+        self.assertEqual(movie['created_at'], movie['updated_at'])
+        since = response.json['since']
+        self.assertFalse(response.json['has_more'])
+
+        self.login()
+        self.client.post('/', data=dict(title='New Movie', year='2019'))
+        self.client.post('/movie/edit/1', data=dict(title='Test Movie Title', year='2020'))
+        self.client.post('/movie/bulk', data=dict(action='unread', ids=['1']))    # 没有变化，不产生变更
+        self.client.post('/movie/delete/1')
+        response = self.client.get('/api/v1/changes?since=%d&limit=1' % since)
+        self.assertEqual(response.json['items'][0]['movie']['title'], 'New Movie')
+        self.assertTrue(response.json['has_more'])
+        response = self.client.get(response.json['next'])
+        self.assertEqual(response.json['items'], [dict(seq=since + 3, op='delete', id=1,
+                                                       deleted_at=response.json['items'][0]['deleted_at'])])
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % (since + 3)).json['items'], [])
+        self.assertEqual(self.client.get('/api/v1/changes?since=-1').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % 2 ** 63).status_code, 400)
+
+        # 清理墓碑后，更早的同步点需要重新全量同步
+        result = self.runner.invoke(args=['prune-tombstones', '--days', '-1'])
+        self.assertIn('Pruned 1 tombstones.', result.output)
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % since).status_code, 410)
+        self.assertEqual([item['movie']['title'] for item in self.client.get('/api/v1/changes').json['items']],
+                         ['New Movie'])
+
+    # 测试增量维护的统计
+    def test_stats(self):
+        self.login()
+        self.client.post('/', data=dict(title='Leon', year='1994', is_read='True'))
+        self.client.post('/', data=dict(title='WALL-E', year='2008'))
+        self.client.post('/movie/edit/3', data=dict(title='WALL-E', year='2008', is_read='True'))
+        self.client.post('/api/v1/movies/bulk', json=dict(action='delete', ids=[1]))
+        stats = self.client.get('/stats').json
+        self.assertEqual((stats['total'], stats['read'], stats['unread']), (2, 2, 0))
+        self.assertEqual([d['decade'] for d in stats['decades']], [2000, 1990])
+        self.assertEqual(stats['years'][0], dict(year=2008, read=1, unread=0, total=1))
+        self.assertIn('2 Titles (2 read, 0 unread)', self.client.get('/').get_data(as_text=True))
+
+        # 汇总表被破坏后可以用命令重建
+        db.session.execute(db.text('DELETE FROM movie_stats'))
+        db.session.commit()
+        stats_cache.clear()
+        self.assertEqual(self.client.get('/stats').json['total'], 0)
+        result = self.runner.invoke(args=['rebuild-stats'])
+        self.assertIn('Rebuilt statistics (2 groups).', result.output)
+        self.assertEqual(self.client.get('/stats').json, stats)
+
+    # 测试首页和 API 的筛选、排序和分面计数
+    def test_filters_and_sorting(self):
+        db.session.add_all([Movie(title='Leon', year=1994, is_read=True, user_id=1),
+                            Movie(title='Amelie', year=2001, user_id=1),
+                            Movie(title='Totoro', year=1988, user_id=1),
+                            Movie(title='Ghost', year=1990, user_id=1)])
+        db.session.commit()
+
+        data = self.client.get('/?is_read=false&decade=1990').get_data(as_text=True)
+        self.assertIn('Ghost', data)
+        self.assertNotIn('Leon', data)
+        self.assertIn('Read (1)', data)    # 1990 年代中已阅的数量
+        self.assertIn('1980s (1)', data)    # 未阅中 1980 年代的数量
+        self.assertEqual(self.client.get('/?sort=oldest').status_code, 400)
+        self.assertEqual(self.client.get('/?year=%d' % 2 ** 64).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/movies?decade=99999').status_code, 400)
+
+        # 多列游标翻页
+        titles, url = [], '/api/v1/movies?sort=-year&limit=2&facets=1'
+        while url:
+            response = self.client.get(url).json
+            titles += [item['title'] for item in response['items']]
+            url = response['next']
+        self.assertEqual(titles, ['Test Movie Title', 'Amelie', 'Leon', 'Ghost', 'Totoro'])
+        facets = self.client.get('/api/v1/movies?year=1994&facets=1').json['facets']
+        self.assertEqual(facets['is_read'], dict(true=1, false=0))
+        data = self.client.get('/api/v1/movies?sort=title&limit=2').json
+        self.assertEqual([item['title'] for item in data['items']], ['Amelie', 'Ghost'])
+        self.assertEqual(self.client.get(data['next']).json['items'][0]['title'], 'Leon')
+        self.assertEqual(self.client.get('/api/v1/movies?sort=title&after=xyz').status_code, 400)
+        # 超出 64 位整数范围的游标
+        self.assertEqual(self.client.get('/?after=%d' % 2 ** 63).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/movies?before=%d' % -2 ** 64).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/movies?sort=year&after=' + encode_cursor([2000, 2 ** 63])).status_code, 400)
+
+    # 测试每种筛选和排序组合都按索引顺序范围扫描
+    def test_filter_query_plans(self):
+        for sort, (columns, descending) in SORTS.items():
+            for is_read, decade, after in itertools.product(('', 'true'), ('', '1990'), (False, True)):
+                filters = parse_filters(MultiDict(dict(sort=sort, is_read=is_read, decade=decade)))
+                cursor = encode_cursor(['Leon', 1994, 3][-len(columns):]) if after and len(columns) > 1 \
+                    else ('3' if after else None)
+                statement = sorted_statement(db.select(Movie), 1, filters, cursor).limit(51)
+                sql = str(statement.compile(db.engine, compile_kwargs=dict(literal_binds=True)))
+                plan = ' '.join(row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+                message = '%s %s %s %s: %s' % (sort, is_read, decade, after, plan)
+                self.assertIn('SEARCH movie USING', plan, message)
+                self.assertIn('user_id=?', plan, message)
+                self.assertNotIn('TEMP B-TREE', plan, message)
+
+    # 测试添加时提示可能重复的标题
+    def test_duplicate_warning(self):
+        self.assertEqual(normalize_title('  Léon: The Professional '), 'leontheprofessional')
+        self.assertEqual(normalize_title('流浪地球２'), '流浪地球2')
+        db.session.add_all([Movie(title='Léon', year=1994, user_id=1),
+                            Movie(title='The Shawshank Redemption', year=1994, user_id=1),
+                            Movie(title='流浪地球1', year=2019, user_id=1)])
+        db.session.commit()
+
+        self.login()
+        data = self.client.post('/', data=dict(title='leon', year='1994'), follow_redirects=True).get_data(as_text=True)
+        self.assertIn('Possible duplicate of Léon (1994).', data)
+        data = self.client.post('/', data=dict(title='The Shawshank Redemtion', year='1995'),
+                                follow_redirects=True).get_data(as_text=True)
+        self.assertIn('Possible duplicate of The Shawshank Redemption (1994).', data)
+        data = self.client.post('/', data=dict(title='流浪地球2', year='2023'), follow_redirects=True).get_data(as_text=True)
+        self.assertNotIn('Possible duplicate', data)
+        data = self.client.post('/movie/edit/2', data=dict(title='Léon', year='1994'),
+                                follow_redirects=True).get_data(as_text=True)
+        self.assertIn('Possible duplicate of leon (1994).', data)    # 不和自己比较
+
+    # 测试批量合并重复的电影
+    def test_dedupe_command(self):
+        db.session.add_all([Movie(title='Leon', year=1994, user_id=1),
+                            Movie(title='LÉON', year=1994, is_read=True, user_id=1),
+                            Movie(title='Leon', year=2024, user_id=1),    # 不同年份
+                            Movie(title='Leon', year=1994, user_id=2)])    # 不同用户
+        db.session.commit()
+        result = self.runner.invoke(args=['dedupe'])
+        self.assertIn('User 1: Leon (1994) x2, ids 2, 3', result.output)
+        self.assertIn('Found 1 duplicate clusters.', result.output)
+
+        result = self.runner.invoke(args=['dedupe', '--merge'])
+        self.assertIn('Merged 1 clusters, deleted 1 movies.', result.output)
+        self.assertEqual(Movie.query.count(), 4)
+        self.assertTrue(db.session.get(Movie, 2).is_read)
+        self.assertIn('Found 0 duplicate clusters.', self.runner.invoke(args=['dedupe']).output)
+
     # 测试登录保护
     def test_login_protect(self):
         response = self.client.get('/')
@@ -201,6 +771,55 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertNotIn('Login success.', data)
         self.assertIn('Invalid input.', data)
 
+    # 测试修改散列参数后登录时重新散列
+    def test_password_rehash(self):
+        user = db.session.get(User, 1)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(user.needs_rehash())
+
+        app.config['WATCHLIST_PASSWORD_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertTrue(user.needs_rehash())
+        self.login()
+        db.session.refresh(user)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(user.validate_password('123'))
+        data = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('watchlist_operation_duration_seconds_count{operation="password_verify"} 1', data)
+        self.assertIn('watchlist_operation_duration_seconds_count{operation="password_hash"} 1', data)
+
+        # 省略参数的方法按 werkzeug 补上的默认参数比较，不会每次登录都重新散列
+        app.config['WATCHLIST_PASSWORD_METHOD'] = 'scrypt'
+        user.set_password('123')
+        self.assertTrue(user.password_hash.startswith('scrypt:32768:8:1$'))
+        self.assertFalse(user.needs_rehash())
+
+    # 测试登录限流，超出的尝试不计算散列
+    def test_login_rate_limit(self):
+        app.config['WATCHLIST_LOGIN_BURST'] = 2
+        for _ in range(2):
+            response = self.client.post('/login', data=dict(username='test', password='456'))
+            self.assertEqual(response.status_code, 302)
+        response = self.client.post('/login', data=dict(username='test', password='123'))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertIn('Too many login attempts', response.get_data(as_text=True))
+        self.assertEqual(registry.timers['password_verify'].count, 2)
+
+        # 其他用户名同样受 IP 限制
+        response = self.client.post('/login', data=dict(username='other', password='123'))
+        self.assertEqual(response.status_code, 429)
+
+        # 被拒绝的尝试不为新用户名记录令牌桶
+        for i in range(20):
+            self.client.post('/login', data=dict(username='user%d' % i, password='123'))
+        self.assertEqual(len(login_limiter), 2)    # 这个 IP 和 test 用户名
+
+        # 已经补满的桶被清除
+        login_limiter.acquire([('ip', 'a')], rate=1000, burst=2)
+        time.sleep(0.01)
+        login_limiter.acquire([('ip', 'b')], rate=1000, burst=2)
+        self.assertEqual(len(login_limiter), 1)
+
     # 测试登出
     def test_logout(self):
         self.login()
@@ -246,11 +865,322 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertIn('Done.', result.output)
         self.assertNotEqual(Movie.query.count(), 0)
 
+    # 测试批量生成虚拟数据
+    def test_forge_count(self):
+        result = self.runner.invoke(args=['forge', '--count', '50', '--seed', '1', '--batch-size', '20'])
+        self.assertIn('Generated 40 movies...', result.output)
+        self.assertIn('Done.', result.output)
+        self.assertEqual(Movie.query.count(), 1 + 23 + 50)
+
+    # 测试动态压缩和条件请求
+    def test_response_compression(self):
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertIn('Test Movie Title', gzip.decompress(response.data).decode('utf-8'))
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # 命中页面缓存时复用压缩结果；关闭压缩后仍然支持条件请求
+        page, = page_cache._data.values()
+        self.assertIn('gzip', page.encoded)
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertIs(response.data, page.encoded['gzip'])
+        app.config['WATCHLIST_COMPRESS_ENABLED'] = False
+        self.addCleanup(app.config.__setitem__, 'WATCHLIST_COMPRESS_ENABLED', True)
+        response = self.client.get('/', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 304)
+        app.config['WATCHLIST_COMPRESS_ENABLED'] = True
+
+        # 压缩后的 API 响应带弱 ETag，重新验证时不执行视图
+        db.session.add_all([Movie(title='Movie %d' % i, year=2000, user_id=1) for i in range(50)])
+        db.session.commit()
+        response = self.client.get('/api/v1/movies', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        with self.count_queries() as statements:
+            response = self.client.get('/api/v1/movies', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([s for s in statements if 'FROM movie' in s])
+
+        # 错误页面也压缩，但没有 ETag
+        app.config['WATCHLIST_COMPRESS_MIN_SIZE'] = 0
+        self.addCleanup(app.config.__setitem__, 'WATCHLIST_COMPRESS_MIN_SIZE', 1024)
+        response = self.client.get('/nothing', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('ETag', response.headers)
+
+        # 小于阈值、重定向和流式响应不压缩
+        app.config['WATCHLIST_COMPRESS_MIN_SIZE'] = 1024
+        response = self.client.get('/api/v1/movies/1', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.client.get('/logout', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.client.get('/?stream=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Test Movie Title', response.get_data(as_text=True))
+
+    # 测试静态文件指纹和预压缩
+    def test_build_assets_command(self):
+        build = os.path.join(app.static_folder, assets.BUILD_DIR)
+        self.addCleanup(assets.load_manifest, app.static_folder)
+        self.addCleanup(shutil.rmtree, build, True)
+
+        result = self.runner.invoke(args=['build-assets'])
+        self.assertIn('Built', result.output)
+        hashed = assets.manifest['CSS/style.css']
+        self.assertRegex(hashed, r'^build/CSS/style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(app.static_folder, hashed + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(app.static_folder, assets.manifest['images/avatar.png'] + '.gz')))
+
+        data = self.client.get('/login').get_data(as_text=True)
+        self.assertIn('/static/' + hashed, data)
+        self.assertIn('/static/' + assets.manifest['images/avatar.png'], data)
+
+        response = self.client.get('/static/' + hashed, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        with open(os.path.join(app.static_folder, 'CSS', 'style.css'), 'rb') as f:
+            self.assertEqual(gzip.decompress(response.data), f.read())
+        response.close()
+
+        response = self.client.get('/static/' + hashed)
+        self.assertNotIn('Content-Encoding', response.headers)
+        response.close()
+        response = self.client.get('/static/CSS/style.css')    # 原文件名仍然可以访问
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
     # 测试初始化数据库
     def test_initdb_command(self):
         result = self.runner.invoke(initdb)
         self.assertIn('Initialized database.', result.output)
 
+    # 测试升级旧版数据库结构
+    def test_upgrade_db_command(self):
+        Movie.__table__.drop(db.engine)
+        db.session.execute(db.text('CREATE TABLE movie (id INTEGER NOT NULL, title VARCHAR(60), '
+                                   'year VARCHAR(10), is_read BOOLEAN, PRIMARY KEY (id))'))    # 没有 user_id
+        db.session.execute(db.text("INSERT INTO movie VALUES (1, 'Leon', '1994', 0), (2, 'WALL-E', ' 2008', 1), "
+                                   "(3, 'Unknown', 'n/a', 0)"))
+        db.session.commit()
+
+        result = self.runner.invoke(args=['upgrade-db', '--batch-size', '2'])
+        self.assertIn('Copied 3 rows...', result.output)
+        self.assertIn('Upgraded database.', result.output)
+        self.assertEqual([(m.year, m.is_read) for m in Movie.query.order_by(Movie.id)],
+                         [(1994, False), (2008, True), (None, False)])
+        self.assertEqual(Movie.query.filter_by(user_id=1).count(), 3)    # 归到第一个用户名下
+        self.assertEqual(db.session.get(Movie, 2).title_key, 'walle')    # 回填规范化标题
+        seqs = [m.seq for m in Movie.query.order_by(Movie.id)]    # 回填变更序号
+        self.assertEqual(seqs, sorted(set(seqs)))
+        self.assertIsNotNone(db.session.get(Movie, 1).created_at)
+        indexes = {row[1] for row in db.session.execute(db.text('PRAGMA index_list(movie)'))}
+        self.assertIn('ix_movie_user_is_read_year_id', indexes)
+        self.assertIn('WALL-E', self.client.get('/search?q=wall').get_data(as_text=True))
+        self.assertIn('Unknown', self.client.get('/search?q=unknown').get_data(as_text=True))    # 第二批
+
+        # 再次运行不会重复转换
+        result = self.runner.invoke(args=['upgrade-db'])
+        self.assertNotIn('Converting', result.output)
+        self.assertEqual(Movie.query.count(), 3)
+        db.session.add(Movie(title='New', user_id=1))
+        db.session.commit()
+        self.assertGreater(Movie.query.filter_by(title='New').one().seq, seqs[-1])
+
+    # 测试导入和导出
+    def test_import_export_commands(self):
+        path = os.path.join(tempfile.mkdtemp(), 'movies.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('title,year,is_read\n'
+                    'Leon,1994,true\n'
+                    '流浪地球2,2023,0\n'
+                    'Leon,1994,false\n'    # 文件内重复
+                    'Test Movie Title,2019,\n'    # 与已有数据重复
+                    ',2000,\n')    # 无效
+        result = self.runner.invoke(args=['import', path, '--batch-size', '2'])
+        self.assertIn('Imported 2 movies, skipped 2 duplicates and 1 invalid rows', result.output)
+        self.assertEqual(Movie.query.count(), 3)
+        self.assertTrue(Movie.query.filter_by(title='Leon').one().is_read)
+
+        export_path = os.path.join(os.path.dirname(path), 'movies.jsonl')
+        result = self.runner.invoke(args=['export', export_path])
+        self.assertIn('Exported 3 movies', result.output)
+        with open(export_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"title": "流浪地球2"', lines[2])
+
+        # 再次导入导出的文件，全部被去重
+        result = self.runner.invoke(args=['import', export_path])
+        self.assertIn('Imported 0 movies, skipped 3 duplicates', result.output)
+
+        # 无法解析的行和不是对象的行计为无效行
+        with open(export_path, 'w', encoding='utf-8') as f:
+            f.write('{"title": "Heat", "year": 1995}\n{"title": \n[1, 2]\n')
+        result = self.runner.invoke(args=['import', export_path])
+        self.assertIn('Imported 1 movies, skipped 0 duplicates and 2 invalid rows', result.output)
+
+        # .json 文件是 JSON 数组
+        json_path = os.path.join(os.path.dirname(path), 'movies.json')
+        result = self.runner.invoke(args=['export', json_path])
+        self.assertIn('Exported 4 movies', result.output)
+        with open(json_path, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 4)
+        result = self.runner.invoke(args=['import', json_path])
+        self.assertIn('Imported 0 movies, skipped 4 duplicates', result.output)
+
+    # 测试在线备份：备份期间持续写入，写操作不会被阻塞，备份也不会因为写入而重新开始
+    def test_backup_under_write_load(self):
+        db.session.execute(db.insert(Movie), [dict(title='Movie %d' % i, year=2000, user_id=1)
+                                              for i in range(20000)])
+        db.session.commit()
+        self.login()
+        path = os.path.join(tempfile.mkdtemp(), 'backup.db.gz')
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(
+            output=self.runner.invoke(args=['backup', path, '--check', '--pages', '16', '--sleep', '0.002']).output))
+        thread.start()
+        latencies = []
+        while thread.is_alive():
+            start = time.perf_counter()
+            response = self.client.post('/', data=dict(title='Written %d' % len(latencies), year='2020'))
+            latencies.append(time.perf_counter() - start)
+            self.assertEqual(response.status_code, 302)
+        thread.join()
+        self.assertIn('Integrity check passed.', result['output'])
+        self.assertRegex(result['output'], r'Backed up \d+ pages .* MiB/s')
+        self.assertGreater(len(latencies), 5)
+        self.assertLess(max(latencies), 0.5)
+
+        with gzip.open(path) as src, open(path[:-3], 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        conn = sqlite3.connect(path[:-3])
+        count = conn.execute('SELECT count(*) FROM movie').fetchone()[0]
+        conn.close()
+        self.assertGreaterEqual(count, 20001)    # 备份是开始时的一致快照
+        self.assertLess(count, Movie.query.count())
+
+    # 测试从备份恢复
+    def test_restore_command(self):
+        self.client.get('/api/v1/changes')
+        path = os.path.join(tempfile.mkdtemp(), 'backup.db')
+        self.assertIn('Backed up', self.runner.invoke(args=['backup', path]).output)
+        db.session.delete(db.session.get(Movie, 1))
+        db.session.commit()
+        since = self.client.get('/api/v1/changes').json['since']
+        self.assertEqual(Movie.query.count(), 0)
+
+        result = self.runner.invoke(args=['restore', path])    # 没有确认
+        self.assertEqual(Movie.query.count(), 0)
+        result = self.runner.invoke(args=['restore', path, '--yes'])
+        self.assertIn('Restored', result.output)
+        self.assertEqual(Movie.query.count(), 1)
+        self.assertIn('Test Movie Title', self.client.get('/').get_data(as_text=True))
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % since).status_code, 410)
+
+        with open(path, 'r+b') as f:    # 损坏的备份不会被恢复
+            f.seek(4096)
+            f.write(b'\xff' * 4096)
+        result = self.runner.invoke(args=['restore', path, '--yes'])
+        self.assertIn('Integrity check failed', result.output)
+        self.assertEqual(Movie.query.count(), 1)
+
+    # 测试后台任务：通过 API 提交获取资料的任务，查询进度，执行后列表链接到条目
+    def test_enrich_job(self):
+        app.config['WATCHLIST_ENRICH_PROVIDER'] = StaticProvider(
+            {('test movie title', 2019): dict(site='imdb', url='https://www.imdb.com/title/tt0000001/')})
+        db.session.add(Movie(title='Unknown', year=2000, user_id=1))
+        db.session.commit()
+        self.assertEqual(self.client.post('/api/v1/jobs', json=dict(kind='enrich')).status_code, 401)
+        self.login()
+        self.assertEqual(self.client.post('/api/v1/jobs', json=dict(kind='import')).status_code, 400)
+        response = self.client.post('/api/v1/jobs', json=dict(kind='enrich'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(response.headers['Location']).json['status'], 'queued')
+
+        result = self.runner.invoke(args=['jobs', 'work'])
+        self.assertIn('Ran 1 jobs.', result.output)
+        job = self.client.get(response.headers['Location']).json
+        self.assertEqual((job['status'], job['progress'], job['total']), ('done', 2, 2))
+        self.assertEqual(job['result'], dict(enriched=2, found=1))
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('https://www.imdb.com/title/tt0000001/', data)
+        self.assertIn('https://www.imdb.com/find?q=Unknown', data)
+        movie = db.session.get(Movie, 1)
+        self.assertEqual((movie.link_site, movie.link_url), ('imdb', 'https://www.imdb.com/title/tt0000001/'))
+
+        # 执行线程池
+        app.config['WATCHLIST_JOB_WORKERS'] = 1
+        app.config['WATCHLIST_ENRICH_PROVIDER'] = 'watchlist.enrich:StaticProvider'    # 缺少参数，任务失败
+        runner.start(app)
+        self.addCleanup(runner.stop)
+        job_id = self.client.post('/api/v1/jobs', json=dict(kind='enrich', force=True)).json['id']
+        for _ in range(50):
+            job = self.client.get('/api/v1/jobs/%d' % job_id).json
+            if job['status'] != 'running' and job['attempts']:
+                break
+            time.sleep(0.1)
+        self.assertEqual((job['status'], job['attempts']), ('queued', 1))    # 等待重试
+        self.assertIn('TypeError', job['error'])
+        self.assertEqual(self.client.post('/api/v1/jobs/%d/cancel' % job_id).json['status'], 'cancelled')
+        self.assertEqual(self.client.post('/api/v1/jobs/%d/cancel' % job_id).status_code, 409)
+        runner.stop()
+
+    # 测试任务的重试、取消和命令行
+    def test_jobs_command(self):
+        class FlakyProvider(Provider):
+            calls = 0
+
+            def lookup(self, title, year=None):
+                FlakyProvider.calls += 1
+                if FlakyProvider.calls == 1:
+                    raise OSError('Network is unreachable')
+                return None
+
+        class IncompleteProvider(Provider):
+            pass
+
+        self.assertRaises(TypeError, IncompleteProvider)    # 没有实现 lookup()
+        app.config.update(WATCHLIST_ENRICH_PROVIDER=FlakyProvider(), WATCHLIST_JOB_RETRY_DELAY=0)
+        self.assertIn('Queued job #1.', self.runner.invoke(args=['jobs', 'submit', 'enrich']).output)
+        result = self.runner.invoke(args=['jobs', 'work'])
+        self.assertIn('#1 enrich queued 0 (attempt 1/3) OSError: Network is unreachable', result.output)
+        self.assertIn('#1 enrich done 1/1 (attempt 2/3) {"enriched": 1, "found": 0}', result.output)
+        self.assertEqual(db.session.get(Movie, 1).info, {})
+
+        # 执行中取消：下一次报告进度时停止，已经处理的批次保留
+        db.session.add_all([Movie(title='Movie %d' % i, user_id=1) for i in range(3)])
+        db.session.commit()
+        self.runner.invoke(args=['jobs', 'submit', 'enrich', '-p', 'batch_size=1', '-p', 'force=true'])
+
+        def cancel_during_lookup(provider, title, year=None):
+            self.runner.invoke(args=['jobs', 'cancel', '2'])
+
+        FlakyProvider.lookup = cancel_during_lookup
+        result = self.runner.invoke(args=['jobs', 'work'])
+        self.assertIn('#2 enrich cancelled 1/4', result.output)
+        self.assertIn('#2 enrich queued 0/4 (attempt 0/3)', self.runner.invoke(args=['jobs', 'retry', '2']).output)
+        self.assertIn('Job #1 has not failed.', self.runner.invoke(args=['jobs', 'retry', '1']).output)
+
+        path = os.path.join(tempfile.mkdtemp(), 'movies.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('title,year\nLeon,1994\n')
+        result = self.runner.invoke(args=['jobs', 'submit', 'import', '-p', 'path=%s' % path])
+        self.assertIn('Queued job #3.', result.output)
+        self.assertEqual(self.runner.invoke(args=['jobs', 'submit', 'nothing']).exit_code, 2)
+        self.assertIn('#3 import queued', self.runner.invoke(args=['jobs', 'list', '--status', 'queued']).output)
+
     # 测试生成管理员账户
     def test_admin_command(self):
         db.drop_all()
@@ -265,13 +1195,18 @@ class WatchlistTestCase(unittest.TestCase):
     # 测试更新管理员账户
     def test_admin_command_update(self):
         # 使用 args 参数给出完整的命令参数列表
-        result = self.runner.invoke(args=['admin', '--username', 'peter', '--password', '456'])
+        result = self.runner.invoke(args=['admin', '--username', 'test', '--password', '456'])
         self.assertIn('Updating user...', result.output)
         self.assertIn('Done.', result.output)
         self.assertEqual(User.query.count(), 1)
-        self.assertEqual(User.query.first().username, 'peter')
         self.assertTrue(User.query.first().validate_password('456'))
 
+        # 新的用户名创建另一个用户
+        result = self.runner.invoke(args=['admin', '--username', 'peter', '--password', '789'])
+        self.assertIn('Creating user...', result.output)
+        self.assertEqual(User.query.count(), 2)
+        self.assertTrue(User.query.filter_by(username='peter').one().validate_password('789'))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,8 +1,12 @@
 import os
 import sys
 from flask import Flask
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from watchlist.engine import engine_options, install_sqlite_pragmas, SQLITE_PRAGMAS
 
 # SQLite URI compatible
 WIN = sys.platform.startswith('win')
@@ -11,59 +15,133 @@ if WIN:
 else:
     prefix = 'sqlite:////'
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = \
-    os.getenv('SECRET_KEY', 'dev')
-app.config['SQLALCHEMY_DATABASE_URI'] = \
-    prefix + \
-    os.path.join(os.path.dirname(app.root_path),
-                 os.getenv('DATABASE_FILE', 'data.db'))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] \
-    = False
-
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+# login_manager.login_message = 'Your custom message'
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    from watchlist.models import User
-    user = User.query.get(int(user_id))
-    return user
-
-
-login_manager.login_view = 'login'
-# login_manager.login_message = 'Your custom message'
-
-
-@app.context_processor
-def inject_user():
-    from watchlist.models import User
-    user = User.query.first()
-    return dict(user=user)
-
-
-@app.context_processor
-def inject_function():
-    # 定义要引入的函数
-
-    # 判断是否为中文字符
-    def is_chinese(char):
-        if '\u4e00' <= char <= '\u9fa5':
-            return True
-        else:
-            return False
-
-    # 判断是否包含中文字符
-    def contains_chinese(text):
-        for char in text:
-            if is_chinese(char):
-                return True
-        return False
-
-    return {
-        'contains_chinese': contains_chinese
-    }
-
-
-from watchlist import views, errors, commands
\ No newline at end of file
+    from watchlist.profiles import get_profile
+    return get_profile(int(user_id))    # 使用缓存的用户资料，不必每个请求都查询
+
+
+class LazyCommands(AppGroup):
+    # 命令行命令定义在 commands.py 中，第一次查找命令时才导入，Web worker 启动时不需要加载
+
+    def _commands(self):
+        from watchlist.commands import cli
+        return cli
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+
+def create_app(config=None):
+    # 应用工厂：导入 watchlist 包本身不创建应用，也不加载视图和命令；
+    # config 是覆盖默认配置的字典，例如测试使用的数据库
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = \
+        os.getenv('SECRET_KEY', 'dev')
+    # DATABASE_URL 可以指向其他数据库，例如 postgresql://...
+    app.config['SQLALCHEMY_DATABASE_URI'] = \
+        os.getenv('DATABASE_URL', prefix +
+                  os.path.join(os.path.dirname(app.root_path),
+                               os.getenv('DATABASE_FILE', 'data.db')))
+    # 每个 SQLite 连接建立时执行的 PRAGMA
+    app.config['WATCHLIST_SQLITE_PRAGMAS'] = dict(SQLITE_PRAGMAS)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] \
+        = False
+    # 主页分页：默认每页条数和允许的最大条数
+    app.config['WATCHLIST_PER_PAGE'] = \
+        int(os.getenv('WATCHLIST_PER_PAGE', 50))
+    app.config['WATCHLIST_MAX_PER_PAGE'] = \
+        int(os.getenv('WATCHLIST_MAX_PER_PAGE', 200))
+    # 用户资料在进程内缓存的秒数和最多缓存的用户数
+    app.config['WATCHLIST_PROFILE_TTL'] = \
+        int(os.getenv('WATCHLIST_PROFILE_TTL', 60))
+    app.config['WATCHLIST_PROFILE_CACHE_SIZE'] = \
+        int(os.getenv('WATCHLIST_PROFILE_CACHE_SIZE', 1024))
+    # 主页渲染结果缓存
+    app.config['WATCHLIST_CACHE_ENABLED'] = \
+        os.getenv('WATCHLIST_CACHE_ENABLED', '1') == '1'
+    app.config['WATCHLIST_CACHE_SIZE'] = \
+        int(os.getenv('WATCHLIST_CACHE_SIZE', 128))
+    # 流式渲染：每批读取的行数和每次发送的字符数
+    app.config['WATCHLIST_STREAM_BATCH_SIZE'] = \
+        int(os.getenv('WATCHLIST_STREAM_BATCH_SIZE', 500))
+    app.config['WATCHLIST_STREAM_CHUNK_SIZE'] = \
+        int(os.getenv('WATCHLIST_STREAM_CHUNK_SIZE', 16 * 1024))
+    # 动态压缩：最小压缩字节数和压缩级别
+    app.config['WATCHLIST_COMPRESS_ENABLED'] = \
+        os.getenv('WATCHLIST_COMPRESS_ENABLED', '1') == '1'
+    app.config['WATCHLIST_COMPRESS_MIN_SIZE'] = \
+        int(os.getenv('WATCHLIST_COMPRESS_MIN_SIZE', 1024))
+    app.config['WATCHLIST_COMPRESS_LEVEL'] = \
+        int(os.getenv('WATCHLIST_COMPRESS_LEVEL', 6))
+    app.config['WATCHLIST_BROTLI_QUALITY'] = \
+        int(os.getenv('WATCHLIST_BROTLI_QUALITY', 4))
+    # 请求统计和慢请求日志（毫秒，0 表示关闭）
+    app.config['WATCHLIST_METRICS_ENABLED'] = \
+        os.getenv('WATCHLIST_METRICS_ENABLED', '1') == '1'
+    app.config['WATCHLIST_SLOW_REQUEST_MS'] = \
+        int(os.getenv('WATCHLIST_SLOW_REQUEST_MS', 0))
+    # 密码散列方法和完整的参数，例如 scrypt:32768:8:1 或 pbkdf2:sha256:600000；
+    # 修改后用户下次登录时自动用新参数重新散列
+    app.config['WATCHLIST_PASSWORD_METHOD'] = \
+        os.getenv('WATCHLIST_PASSWORD_METHOD', 'scrypt:32768:8:1')
+    app.config['WATCHLIST_PASSWORD_SALT_LENGTH'] = \
+        int(os.getenv('WATCHLIST_PASSWORD_SALT_LENGTH', 16))
+    # 登录限流：每个 IP 和每个用户名每分钟可以尝试的次数和允许的突发次数，0 表示不限制
+    app.config['WATCHLIST_LOGIN_PER_MINUTE'] = \
+        float(os.getenv('WATCHLIST_LOGIN_PER_MINUTE', 10))
+    app.config['WATCHLIST_LOGIN_BURST'] = \
+        int(os.getenv('WATCHLIST_LOGIN_BURST', 10))
+    # 前面的反向代理层数：大于 0 时从 X-Forwarded-For 等请求头取得客户端地址，
+    # 否则所有请求的 remote_addr 都是代理的地址，会共用同一个 IP 限流桶
+    app.config['WATCHLIST_PROXY_COUNT'] = \
+        int(os.getenv('WATCHLIST_PROXY_COUNT', 0))
+    # 后台任务：每个 Web 进程的执行线程数（0 表示只由 flask jobs work 执行）、空闲时的轮询间隔、
+    # 执行中的任务多久没有心跳视为中断（秒），以及第一次重试前等待的秒数（之后每次加倍）
+    app.config['WATCHLIST_JOB_WORKERS'] = \
+        int(os.getenv('WATCHLIST_JOB_WORKERS', 2))
+    app.config['WATCHLIST_JOB_POLL'] = \
+        float(os.getenv('WATCHLIST_JOB_POLL', 5))
+    app.config['WATCHLIST_JOB_TIMEOUT'] = \
+        int(os.getenv('WATCHLIST_JOB_TIMEOUT', 600))
+    app.config['WATCHLIST_JOB_RETRY_DELAY'] = \
+        float(os.getenv('WATCHLIST_JOB_RETRY_DELAY', 30))
+    # 电影资料来源，例如 watchlist.enrich:OMDbProvider，为空时不获取资料
+    app.config['WATCHLIST_ENRICH_PROVIDER'] = \
+        os.getenv('WATCHLIST_ENRICH_PROVIDER', '')
+    app.config['WATCHLIST_OMDB_API_KEY'] = \
+        os.getenv('WATCHLIST_OMDB_API_KEY', '')
+    app.config.update(config or {})
+    # 连接池和 SQLite PRAGMA 配置，依赖最终的数据库 URI 和 PRAGMA
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI'],
+                                         app.config['WATCHLIST_SQLITE_PRAGMAS']))
+
+    if app.config['WATCHLIST_PROXY_COUNT'] > 0:
+        count = app.config['WATCHLIST_PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=count, x_proto=count, x_host=count)
+
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, app.config['WATCHLIST_SQLITE_PRAGMAS'])
+    login_manager.init_app(app)
+
+    from watchlist import views, errors, api, metrics, assets, compression, jobs
+    from watchlist.cache import page_cache
+    from watchlist.stats import stats_cache
+    from watchlist.profiles import profile_cache
+    for module in (views, errors, api, metrics, assets, compression, jobs):
+        app.register_blueprint(module.bp)
+    page_cache.maxsize = stats_cache.maxsize = app.config['WATCHLIST_CACHE_SIZE']
+    profile_cache.maxsize = app.config['WATCHLIST_PROFILE_CACHE_SIZE']
+    app.cli = LazyCommands(app.name)
+    return app
@@ -0,0 +1,258 @@
+import hashlib
+from functools import wraps
+
+from flask import Blueprint, request, url_for, jsonify, make_response
+from flask_login import current_user
+
+from watchlist import db
+from watchlist.models import Movie, Job, validate_movie, parse_ids, bulk_update, BULK_ACTIONS, to_bool, is_int64
+from watchlist.cache import get_version_info, bump_version
+from watchlist.facets import parse_filters, paginate_movies, get_facets, filter_url
+from watchlist.profiles import get_list_owner
+from watchlist.pagination import get_limit
+from watchlist.changes import is_pruned, get_changes
+from watchlist.engine import is_sqlite
+from watchlist.jobs import enqueue, cancel
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def api_error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def api_login_required(view):
+    # API 未登录时返回 401，而不是重定向到登录页面
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return api_error(401, 'Authentication required.')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def conditional(view):
+    # 用清单主人和版本号生成强 ETag，客户端缓存有效时直接返回 304，
+    # 不查询也不序列化电影数据
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        owner = get_list_owner()
+        owner_id = owner.id if owner is not None else None
+        version, modified = get_version_info(owner_id)
+        digest = hashlib.sha1(('%s %s' % (owner_id, request.full_path)).encode('utf-8')).hexdigest()[:16]
+        etag = '%s-%s' % (version, digest)
+
+        if request.if_none_match:
+            # If-None-Match 优先；压缩后的响应带的是弱 ETag（见 compression.py），用弱比较
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            # Last-Modified 只精确到秒，同一秒内可能还有修改，时间相同时视为已修改
+            not_modified = request.if_modified_since is not None \
+                and modified < request.if_modified_since
+        response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.no_cache = True    # 每次都要验证
+            response.vary.add('Cookie')    # 登录用户看到的是自己的清单
+        return response
+    return wrapper
+
+
+def get_movie_or_404(movie_id, user_id):
+    # 只能访问清单主人的电影，别人的电影和不存在的一样返回 404
+    movie = Movie.query.filter_by(id=movie_id, user_id=user_id).first()
+    if movie is None:
+        return None, api_error(404, 'Movie not found.')
+    return movie, None
+
+
+@bp.route('/movies')
+@conditional
+def api_movies():
+    owner = get_list_owner()
+    if owner is None:
+        return api_error(404, 'No users.')
+    # 筛选和排序参数与首页相同，facets=1 时同时返回分面计数
+    try:
+        filters = parse_filters(request.args)
+        page = paginate_movies(owner.id, filters, request.args)
+    except ValueError as e:
+        return api_error(400, str(e))
+    data = dict(
+        items=[movie.to_dict() for movie in page],
+        next=filter_url('api.api_movies', request.args, after=page.next_after) if page.next_after else None,
+        prev=filter_url('api.api_movies', request.args, before=page.prev_before) if page.prev_before else None,
+    )
+    if request.args.get('facets', type=int):
+        data['facets'] = get_facets(owner.id, filters)
+    return jsonify(data)
+
+
+@bp.route('/movies/<int:movie_id>')
+@conditional
+def api_movie(movie_id):
+    owner = get_list_owner()
+    movie, error = get_movie_or_404(movie_id, owner.id if owner is not None else None)
+    return error or jsonify(movie.to_dict())
+
+
+@bp.route('/movies', methods=['POST'])
+@api_login_required
+def api_create_movie():
+    data = validate_movie(request.get_json(silent=True) or {})
+    if data is None:
+        return api_error(400, 'Invalid input.')
+    movie = Movie(user_id=current_user.id, **data)
+    db.session.add(movie)
+    bump_version(current_user.id)
+    db.session.commit()
+    response = jsonify(movie.to_dict())
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.api_movie', movie_id=movie.id)
+    return response
+
+
+@bp.route('/movies/<int:movie_id>', methods=['PUT', 'PATCH'])
+@api_login_required
+def api_update_movie(movie_id):
+    movie, error = get_movie_or_404(movie_id, current_user.id)
+    if error:
+        return error
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error(400, 'Invalid input.')
+    if request.method == 'PATCH':    # 部分更新：未提供的字段保留原值
+        payload = dict(movie.to_dict(), **payload)
+    data = validate_movie(payload)
+    if data is None:
+        return api_error(400, 'Invalid input.')
+    for key, value in data.items():
+        setattr(movie, key, value)
+    bump_version(current_user.id)
+    db.session.commit()
+    return jsonify(movie.to_dict())
+
+
+@bp.route('/movies/<int:movie_id>', methods=['DELETE'])
+@api_login_required
+def api_delete_movie(movie_id):
+    movie, error = get_movie_or_404(movie_id, current_user.id)
+    if error:
+        return error
+    db.session.delete(movie)
+    bump_version(current_user.id)
+    db.session.commit()
+    return '', 204
+
+
+@bp.route('/movies/bulk', methods=['POST'])
+@api_login_required
+def api_bulk_movies():
+    # {"action": "read" | "unread" | "delete", "ids": [1, 2, 3]}
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list):
+        return api_error(400, 'Invalid input.')
+    action = payload.get('action')
+    ids = parse_ids(payload['ids'])
+    if action not in BULK_ACTIONS or not ids:
+        return api_error(400, 'Invalid input.')
+    count = bulk_update(current_user.id, ids, action)
+    bump_version(current_user.id)
+    db.session.commit()
+    return jsonify(action=action, count=count)
+
+
+def isoformat(value):   # 数据库中的时间都是 UTC
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+@bp.route('/changes')
+@conditional
+def api_changes():
+    # 增量同步：返回变更序号 since 之后添加、修改和删除的电影，客户端保存返回的 since，
+    # 下次从这里继续；since=0 时返回全部电影。has_more 为真时应立即继续请求
+    owner = get_list_owner()
+    if owner is None:
+        return api_error(404, 'No users.')
+    if not is_sqlite(db.session.connection()):
+        return api_error(501, 'Change feed is not supported by this database.')
+    since = request.args.get('since', 0, type=int)
+    if since < 0 or not is_int64(since):
+        return api_error(400, 'Invalid since.')
+    if is_pruned(since):
+        return api_error(410, 'Changes have been pruned, sync again from since=0.')
+    changes, has_more = get_changes(owner.id, since, get_limit(request.args.get('limit', type=int)))
+    items = []
+    for seq, movie, tombstone in changes:
+        if movie is not None:
+            items.append(dict(seq=seq, op='upsert', movie=dict(
+                movie.to_dict(), created_at=isoformat(movie.created_at), updated_at=isoformat(movie.updated_at))))
+        else:
+            items.append(dict(seq=seq, op='delete', id=tombstone.movie_id,
+                              deleted_at=isoformat(tombstone.deleted_at)))
+    since = changes[-1][0] if changes else since
+    return jsonify(items=items, since=since, has_more=has_more,
+                   next=url_for('api.api_changes', since=since, limit=request.args.get('limit')) if has_more else None)
+
+
+# 用户可以通过 API 提交的任务类型，导入导出和重建统计只能在命令行提交
+USER_JOBS = ('enrich',)
+
+
+def get_job_or_404(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return None, api_error(404, 'Job not found.')
+    return job, None
+
+
+@bp.route('/jobs')
+@api_login_required
+def api_jobs():
+    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.id.desc()).limit(20)
+    return jsonify(items=[job.to_dict() for job in jobs])
+
+
+@bp.route('/jobs', methods=['POST'])
+@api_login_required
+def api_create_job():
+    # {"kind": "enrich", "ids": [1, 2, 3], "force": false}，返回 202 和任务状态的地址
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or payload.get('kind') not in USER_JOBS:
+        return api_error(400, 'Invalid input.')
+    ids = payload.get('ids')
+    if ids is not None:
+        ids = parse_ids(ids) if isinstance(ids, list) else None
+        if not ids:
+            return api_error(400, 'Invalid input.')
+    try:
+        force = to_bool(payload.get('force'))
+    except ValueError:
+        return api_error(400, 'Invalid input.')
+    params = dict(user_id=current_user.id, ids=ids, force=force)
+    job = enqueue(payload['kind'], params, user_id=current_user.id)
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.api_job', job_id=job.id)
+    return response
+
+
+@bp.route('/jobs/<int:job_id>')
+@api_login_required
+def api_job(job_id):
+    job, error = get_job_or_404(job_id)
+    return error or jsonify(job.to_dict())
+
+
+@bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@api_login_required
+def api_cancel_job(job_id):
+    job, error = get_job_or_404(job_id)
+    if error:
+        return error
+    if not cancel(job):
+        return api_error(409, 'Job has already finished.')
+    return jsonify(job.to_dict())
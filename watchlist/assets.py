@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import Blueprint, current_app, request, send_from_directory
+
+try:
+    import brotli    # 可选依赖，没有安装时只生成 gzip 文件
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'build'    # 相对 static 目录
+MANIFEST = 'manifest.json'
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.ico', '.xml')
+
+# 原始文件名 -> 带内容哈希的文件名，例如 CSS/style.css -> build/CSS/style.1a2b3c4d5e6f.css
+manifest = {}
+hashed_files = set()
+bp = Blueprint('assets', __name__)
+
+
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, BUILD_DIR, MANIFEST)
+    manifest.clear()
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            manifest.update(json.load(f))
+    hashed_files.clear()
+    hashed_files.update(manifest.values())
+
+
+def _compress(path, data):
+    # 只保留比原文件小的压缩版本
+    written = []
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(compressed)
+        written.append('gzip')
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(compressed)
+            written.append('br')
+    return written
+
+
+def build_assets():
+    # 为 static 下的文件生成带哈希的副本和预压缩版本，返回 [(原文件名, 新文件名, 压缩格式)]
+    static = current_app.static_folder
+    build = os.path.join(static, BUILD_DIR)
+    shutil.rmtree(build, ignore_errors=True)
+    results, entries = [], {}
+    for root, dirs, files in os.walk(static):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != build)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, ext = os.path.splitext(filename)
+            hashed = '%s/%s.%s%s' % (BUILD_DIR, stem, digest, ext)
+            target = os.path.join(static, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            encodings = _compress(target, data) if ext.lower() in COMPRESSIBLE else []
+            entries[filename] = hashed
+            results.append((filename, hashed, encodings))
+
+    with open(os.path.join(build, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    load_manifest(static)
+    return results
+
+
+@bp.app_url_defaults
+def hashed_static_url(endpoint, values):
+    # url_for('static', filename='CSS/style.css') 自动指向带哈希的文件
+    if endpoint == 'static' and manifest:
+        filename = values.get('filename')
+        if filename in manifest:
+            values['filename'] = manifest[filename]
+
+
+def serve_static(filename):
+    if filename not in hashed_files:
+        return current_app.send_static_file(filename)
+
+    # 文件名带内容哈希，内容不会变化，可以长期缓存；客户端支持时发送预压缩的文件
+    folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if name in request.accept_encodings and os.path.exists(os.path.join(folder, filename + suffix)):
+            encoding, filename = name, filename + suffix
+            break
+    response = send_from_directory(folder, filename, mimetype=mimetype, max_age=ONE_YEAR)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.record_once
+def install(state):
+    # 注册时替换 Flask 内置的 static 视图，并读取已经生成的清单
+    state.app.view_functions['static'] = serve_static
+    load_manifest(state.app.static_folder)
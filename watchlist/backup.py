@@ -0,0 +1,107 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+PAGES_PER_STEP = 256    # 每一步复制的页数，两步之间让出 CPU 和锁
+
+
+class BackupResult:
+    # 备份或恢复的统计：页数、字节数和耗时
+
+    def __init__(self, pages, page_size, elapsed):
+        self.pages = pages
+        self.bytes = pages * page_size
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):     # MiB/s
+        return self.bytes / 1024 / 1024 / self.elapsed if self.elapsed else 0
+
+
+def _copy(source, target, pages, sleep, progress):
+    # 用 SQLite 的在线备份 API 分步复制。源数据库被其他连接修改时，备份会从头开始，
+    # 写入频繁时可能永远完成不了；所以先在源连接上开启读事务，固定一个快照，
+    # 分步复制都读取这个快照。WAL 模式下读事务不会阻塞写操作
+    source.execute('BEGIN')
+    source.execute('SELECT count(*) FROM sqlite_master').fetchall()
+    start = time.perf_counter()
+
+    def step(status, remaining, total):
+        # backup() 的 sleep 参数只在遇到锁时生效，限速在每一步之后自己暂停
+        if progress:
+            progress(total - remaining, total)
+        if sleep and remaining:
+            time.sleep(sleep)
+
+    try:
+        source.backup(target, pages=pages, progress=step)
+    finally:
+        source.execute('COMMIT')
+    page_size = source.execute('PRAGMA page_size').fetchone()[0]
+    total = target.execute('PRAGMA page_count').fetchone()[0]
+    return BackupResult(total, page_size, time.perf_counter() - start)
+
+
+def check_integrity(path):
+    # 返回 PRAGMA integrity_check 发现的问题，没有问题时为空列表
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:    # 文件头损坏时无法打开
+        rows = [str(e)]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def backup_database(path, target, pages=PAGES_PER_STEP, sleep=0, progress=None):
+    # 把 path 数据库备份到 target，target 以 .gz 结尾时压缩。
+    # 先写到同目录的临时文件，完成后再改名，中途失败不会留下不完整的备份
+    directory = os.path.dirname(os.path.abspath(target))
+    fd, temp = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        source = sqlite3.connect(path, isolation_level=None)
+        dest = sqlite3.connect(temp)
+        try:
+            result = _copy(source, dest, pages, sleep, progress)
+        finally:
+            dest.close()
+            source.close()
+        if target.endswith('.gz'):
+            with open(temp, 'rb') as src, gzip.open(temp + '.gz', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(temp)
+            temp += '.gz'
+        os.replace(temp, target)
+    except BaseException:
+        for name in (temp, temp + '.gz'):
+            if os.path.exists(name):
+                os.remove(name)
+        raise
+    return result
+
+
+def open_backup(path):
+    # 备份文件的本地路径和清理函数，压缩的备份先解压到临时文件
+    if not path.endswith('.gz'):
+        return path, lambda: None
+    fd, temp = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return temp, lambda: os.remove(temp)
+
+
+def restore_database(source_path, path, pages=PAGES_PER_STEP, progress=None):
+    # 用备份文件 source_path 覆盖 path 数据库。复制期间目标数据库被锁定，
+    # 其他连接的写操作会等待到 busy_timeout
+    source = sqlite3.connect(source_path, isolation_level=None)
+    dest = sqlite3.connect(path)
+    try:
+        return _copy(source, dest, pages, 0, progress)
+    finally:
+        dest.close()
+        source.close()
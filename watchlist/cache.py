@@ -0,0 +1,149 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+
+from watchlist import db
+from watchlist.models import Counter
+from watchlist.profiles import get_list_owner, discard_profile
+
+VERSION_KEY = 'watchlist_version'
+MODIFIED_KEY = 'watchlist_modified'    # 最后修改时间（Unix 时间戳，秒）
+
+
+def _counter_names(user_id):
+    # 全局计数器（命令行批量操作使用）和每个用户清单自己的计数器
+    names = [VERSION_KEY, MODIFIED_KEY]
+    if user_id is not None:
+        names += ['%s:%d' % (VERSION_KEY, user_id), '%s:%d' % (MODIFIED_KEY, user_id)]
+    return names
+
+
+def get_version_info(user_id=None):
+    # 返回 (版本号, 最后修改时间)，版本号由全局和用户清单的版本号组合而成，一次查询
+    names = _counter_names(user_id)
+    rows = dict(db.session.execute(
+        db.select(Counter.name, Counter.value).where(Counter.name.in_(names))).all())
+    values = [rows.get(name, 0) for name in names]
+    version = '.'.join(str(value) for value in values[0::2])
+    return version, datetime.fromtimestamp(max(values[1::2]), timezone.utc)
+
+
+def get_version(user_id=None):
+    return get_version_info(user_id)[0]
+
+
+def bump_version(user_id=None):
+    # 清单内容变化时调用，和数据修改在同一个事务里提交；
+    # 只使这个用户的缓存失效，不传 user_id 时使所有用户的缓存失效
+    now = time.time()
+    version_key, modified_key = _counter_names(user_id)[-2:]
+    counter = db.session.get(Counter, version_key)
+    if counter is None:
+        # 用毫秒时间戳作为初始值，重建数据库后也不会和旧版本号重复
+        db.session.add(Counter(name=version_key, value=int(now * 1000)))
+    else:
+        counter.value = Counter.value + 1    # 在 SQL 中自增，避免并发写覆盖
+    db.session.merge(Counter(name=modified_key, value=int(now)))
+
+
+def reset_version():
+    # 恢复备份等替换了整个数据库之后调用：全局版本号改为当前的毫秒时间戳，
+    # 不会和恢复前已经缓存或发给客户端的版本号重复
+    now = time.time()
+    db.session.merge(Counter(name=VERSION_KEY, value=int(now * 1000)))
+    db.session.merge(Counter(name=MODIFIED_KEY, value=int(now)))
+
+
+class PageCache:
+    # 进程内的 LRU 缓存，保存渲染好的页面
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._data), maxsize=self.maxsize)
+
+
+class CachedPage:
+    # 缓存的页面：渲染结果、内容哈希（用作弱 ETag）和各种压缩编码的结果，
+    # 命中缓存时不必重新计算哈希和压缩，见 compression.py
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.encoded = {}    # 编码 -> 压缩后的字节
+
+
+page_cache = PageCache()    # 大小在 create_app() 中按 WATCHLIST_CACHE_SIZE 设置
+
+
+def cached_page(view):
+    # 缓存 GET 请求渲染出的页面，键包含清单主人、版本号和登录状态，
+    # 写操作调用 bump_version() 后旧页面自然失效
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or '_flashes' in session \
+                or not current_app.config['WATCHLIST_CACHE_ENABLED']:
+            return view(*args, **kwargs)    # 有待显示的消息时不能使用缓存
+
+        owner = get_list_owner()
+        owner_id = owner.id if owner is not None else None
+        version = get_version(owner_id)
+        key = (request.endpoint, version, owner_id, current_user.is_authenticated,
+               tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))))
+        # 缓存的用户资料在清单上次修改之前加载，可能已经过期（例如其他进程修改了名字）：
+        # 这次渲染的页面不放进缓存，丢弃资料，下一个请求重新加载。
+        # 登录请求中 current_user 是刚查询的 User 记录，没有 version，总是最新的
+        stale = getattr(owner, 'version', version) != version
+        if stale:
+            discard_profile(owner)
+        page = page_cache.get(key)
+        status = 'HIT'
+        if page is None:
+            rv = view(*args, **kwargs)
+            if not isinstance(rv, str):    # 只缓存直接渲染的模板
+                return rv
+            page = CachedPage(rv)
+            if not stale:
+                page_cache.set(key, page)
+            status = 'MISS'
+        g.cached_page = page
+        response = make_response(page.body)
+        response.headers['X-Cache'] = status
+        return response
+    return wrapper
@@ -0,0 +1,108 @@
+from watchlist import db
+from watchlist.models import Movie, Tombstone, Counter
+from watchlist.engine import is_sqlite, attach_to_table
+
+SEQ_KEY = 'change_seq'    # 最后分配的变更序号
+HORIZON_KEY = 'change_horizon'    # 已清理的墓碑中最大的变更序号
+
+# 当前 UTC 时间，补齐到微秒，和 SQLAlchemy 在 SQLite 中保存 DateTime 的格式一致
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+# 分配下一个变更序号：计数器加一后读出
+NEXT_SEQ_SQL = (
+    "INSERT INTO counter (name, value) VALUES ('%s', 1) "
+    "ON CONFLICT (name) DO UPDATE SET value = value + 1; " % SEQ_KEY)
+CURRENT_SEQ_SQL = "(SELECT value FROM counter WHERE name = '%s')" % SEQ_KEY
+
+# 每次添加、修改或删除电影时分配一个新的变更序号：添加和修改记在 movie.seq 上，
+# 删除写入墓碑表。和 movie_stats 一样由触发器维护，批量修改和导入也会记录。
+# SQLite 同一时间只有一个写事务，序号按提交顺序递增，客户端不会漏掉较早的修改
+CHANGES_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS movie_changes_ai AFTER INSERT ON movie BEGIN " + NEXT_SEQ_SQL +
+    "UPDATE movie SET seq = %s, created_at = ifnull(new.created_at, %s), updated_at = %s "
+    "WHERE id = new.id; END" % (CURRENT_SEQ_SQL, NOW_SQL, NOW_SQL),
+    # 只在这些列的值真正改变时记录，重复标记已阅不产生变更；
+    # 触发器自身只修改 seq 和时间，不会再次触发
+    "CREATE TRIGGER IF NOT EXISTS movie_changes_au AFTER UPDATE OF title, year, is_read, user_id ON movie "
+    "WHEN new.title IS NOT old.title OR new.year IS NOT old.year "
+    "OR new.is_read IS NOT old.is_read OR new.user_id IS NOT old.user_id BEGIN " + NEXT_SEQ_SQL +
+    "UPDATE movie SET seq = %s, updated_at = %s WHERE id = new.id; END" % (CURRENT_SEQ_SQL, NOW_SQL),
+    "CREATE TRIGGER IF NOT EXISTS movie_changes_ad AFTER DELETE ON movie BEGIN " + NEXT_SEQ_SQL +
+    "INSERT INTO tombstone (seq, movie_id, user_id, deleted_at) "
+    "VALUES (%s, old.id, old.user_id, %s); END" % (CURRENT_SEQ_SQL, NOW_SQL),
+]
+
+
+def create_change_triggers(connection):
+    # 创建变更记录的触发器，返回是否是新建的
+    if not is_sqlite(connection):
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'movie_changes_ai'").first()
+    for statement in CHANGES_DDL:
+        connection.exec_driver_sql(statement)
+    return exists is None
+
+
+attach_to_table(Movie.__table__, create_change_triggers)
+
+
+def _counter_value(name):
+    return db.session.execute(db.select(Counter.value).where(Counter.name == name)).scalar() or 0
+
+
+def is_pruned(since):
+    # since 之后的删除记录是否已经被清理，这时客户端只能从 0 开始全量同步
+    return 0 < since < _counter_value(HORIZON_KEY)
+
+
+def get_changes(user_id, since=0, limit=100):
+    # user_id 清单在变更序号 since 之后的修改，按序号排列：
+    # [(序号, 电影或 None, 墓碑或 None)]，以及是否还有更多。
+    # 电影和墓碑各按 (user_id, seq) 索引取 limit + 1 条再合并，代价和变更数量成正比
+    movies = Movie.query.filter(Movie.user_id == user_id, Movie.seq > since) \
+        .order_by(Movie.seq).limit(limit + 1).all()
+    tombstones = Tombstone.query.filter(Tombstone.user_id == user_id, Tombstone.seq > since) \
+        .order_by(Tombstone.seq).limit(limit + 1).all()
+    changes = sorted([(movie.seq, movie, None) for movie in movies] +
+                     [(tombstone.seq, None, tombstone) for tombstone in tombstones],
+                     key=lambda change: change[0])
+    return changes[:limit], len(changes) > limit
+
+
+def prune_tombstones(before):
+    # 删除 before 之前的墓碑，返回删除的数量；同步点早于已清理序号的客户端需要全量同步
+    horizon = db.session.execute(
+        db.select(db.func.max(Tombstone.seq)).where(Tombstone.deleted_at < before)).scalar()
+    if horizon is None:
+        return 0
+    db.session.merge(Counter(name=HORIZON_KEY, value=max(horizon, _counter_value(HORIZON_KEY))))
+    return db.session.execute(db.delete(Tombstone).where(Tombstone.seq <= horizon)).rowcount
+
+
+def expire_changes(last_seq):
+    # 恢复备份之后调用，last_seq 是恢复前最后分配的变更序号：跳过这之前的序号，
+    # 并把它们都标记为已清理，之前同步过的客户端会收到 410，重新全量同步
+    seq = max(last_seq, _counter_value(SEQ_KEY)) + 1
+    db.session.merge(Counter(name=SEQ_KEY, value=seq))
+    db.session.merge(Counter(name=HORIZON_KEY, value=seq))
+
+
+def backfill_changes(batch_size):
+    # 为旧版本数据库中没有序号的电影分配序号（按 id 顺序），生成器，每批返回已处理的数量；
+    # 先一次性预留全部序号，回填期间新的修改不会和回填的序号重复
+    first, last = db.session.execute(db.text(
+        'SELECT min(id), max(id) FROM movie WHERE seq IS NULL')).one()
+    if first is None:
+        return
+    base = _counter_value(SEQ_KEY)
+    db.session.merge(Counter(name=SEQ_KEY, value=base + last))
+    db.session.commit()
+    done = 0
+    for start in range(first, last + 1, batch_size):
+        result = db.session.execute(db.text(
+            'UPDATE movie SET seq = :base + id, created_at = ifnull(created_at, %s), '
+            'updated_at = ifnull(updated_at, %s) WHERE id BETWEEN :start AND :end AND seq IS NULL'
+            % (NOW_SQL, NOW_SQL)), dict(base=base, start=start, end=start + batch_size - 1))
+        db.session.commit()
+        done += result.rowcount
+        yield done
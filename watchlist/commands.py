@@ -1,69 +1,123 @@
+import inspect
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
 import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from watchlist import db
+from watchlist.models import User, Movie, Job, Counter, normalize_title
+from watchlist.cache import bump_version, reset_version
+from watchlist.profiles import invalidate_profiles
+from watchlist.transfer import guess_format, read_rows, import_movies, iter_movies, write_rows
+from watchlist.assets import build_assets, brotli
+from watchlist.search import create_search_index, rebuild_search_index
+from watchlist.engine import is_sqlite
+from watchlist.stats import create_stats_table, rebuild_stats
+from watchlist.dedupe import duplicate_clusters, merge_cluster
+from watchlist.changes import create_change_triggers, backfill_changes, prune_tombstones, expire_changes, SEQ_KEY
+from watchlist.jobs import load_handlers, enqueue, claim_next, run_job, cancel, retry
+from watchlist.backup import backup_database, restore_database, check_integrity, open_backup, PAGES_PER_STEP
 
-from watchlist import app, db
-from watchlist.models import User, Movie
+# 所有命令都注册在这个组上，由 create_app() 中的 LazyCommands 在需要时加载
+cli = AppGroup('watchlist')
 
 
-@app.cli.command()
+@cli.command()
 @click.option('--drop', is_flag=True, help='Create after drop.')
 def initdb(drop):
     """Initialize the database."""
     if drop:
         db.drop_all()
     db.create_all()
+    bump_version()
+    db.session.commit()
     click.echo('Initialized database.')
 
 
-@app.cli.command()
-def forge():
+def fake_movies(count, seed=None):
+    # 用 Faker 生成中英文混合的电影数据
+    from faker import Faker
+
+    fake = Faker(['en_US', 'zh_CN'])
+    if seed is not None:
+        fake.seed_instance(seed)
+    for _ in range(count):
+        title = fake.sentence(nb_words=fake.random_int(1, 4)).rstrip('.。')
+        yield dict(title=title[:60], year=fake.random_int(1900, 2024), is_read=fake.boolean(25))
+
+
+@cli.command()
+@click.option('--count', default=0, show_default=True, help='Number of extra random movies to generate.')
+@click.option('--seed', type=int, help='Random seed for reproducible data.')
+@click.option('--batch-size', default=10000, show_default=True, help='Random movies inserted per transaction.')
+def forge(count, seed, batch_size):
     """Generate fake data."""
     db.create_all()
 
     name = 'Grey Li'
     movies = [
-        {'title': 'My Neighbor Totoro', 'year': '1988', 'is_read': False},
-        {'title': 'Dead Poets Society', 'year': '1989', 'is_read': False},
-        {'title': 'A Perfect World', 'year': '1993', 'is_read': False},
-        {'title': 'Leon', 'year': '1994', 'is_read': False},
-        {'title': 'Mahjong', 'year': '1996', 'is_read': False},
-        {'title': 'Swallowtail Butterfly', 'year': '1996', 'is_read': False},
-        {'title': 'King of Comedy', 'year': '1999', 'is_read': False},
-        {'title': 'Devils on the Doorstep', 'year': '1999', 'is_read': False},
-        {'title': 'WALL-E', 'year': '2008', 'is_read': False},
-        {'title': 'The Pork of Music', 'year': '2012', 'is_read': False},
-        {'title': '头号玩家', 'year': '2018', 'is_read': True},
-        {'title': '流浪地球1', 'year': '2012', 'is_read': False},
-        {'title': '流浪地球2', 'year': '2023', 'is_read': True},
-        {'title': '暮光之城', 'year': '2008', 'is_read': False},
-        {'title': '横空出世', 'year': '1999', 'is_read': False},
-        {'title': '让子弹飞', 'year': '2010', 'is_read': False},
-        {'title': '战狼', 'year': '2015', 'is_read': False},
-        {'title': '战狼2', 'year': '2017', 'is_read': False},
-        {'title': '蜘蛛侠:纵横宇宙', 'year': '2023', 'is_read': False},
-        {'title': '天空之城', 'year': '1986', 'is_read': False},
-        {'title': '银河护卫队3', 'year': '2023', 'is_read': False},
-        {'title': '肖申克的救赎', 'year': '1994', 'is_read': False},
-        {'title': '阿甘正传', 'year': '1994', 'is_read': False},
+        {'title': 'My Neighbor Totoro', 'year': 1988, 'is_read': False},
+        {'title': 'Dead Poets Society', 'year': 1989, 'is_read': False},
+        {'title': 'A Perfect World', 'year': 1993, 'is_read': False},
+        {'title': 'Leon', 'year': 1994, 'is_read': False},
+        {'title': 'Mahjong', 'year': 1996, 'is_read': False},
+        {'title': 'Swallowtail Butterfly', 'year': 1996, 'is_read': False},
+        {'title': 'King of Comedy', 'year': 1999, 'is_read': False},
+        {'title': 'Devils on the Doorstep', 'year': 1999, 'is_read': False},
+        {'title': 'WALL-E', 'year': 2008, 'is_read': False},
+        {'title': 'The Pork of Music', 'year': 2012, 'is_read': False},
+        {'title': '头号玩家', 'year': 2018, 'is_read': True},
+        {'title': '流浪地球1', 'year': 2012, 'is_read': False},
+        {'title': '流浪地球2', 'year': 2023, 'is_read': True},
+        {'title': '暮光之城', 'year': 2008, 'is_read': False},
+        {'title': '横空出世', 'year': 1999, 'is_read': False},
+        {'title': '让子弹飞', 'year': 2010, 'is_read': False},
+        {'title': '战狼', 'year': 2015, 'is_read': False},
+        {'title': '战狼2', 'year': 2017, 'is_read': False},
+        {'title': '蜘蛛侠:纵横宇宙', 'year': 2023, 'is_read': False},
+        {'title': '天空之城', 'year': 1986, 'is_read': False},
+        {'title': '银河护卫队3', 'year': 2023, 'is_read': False},
+        {'title': '肖申克的救赎', 'year': 1994, 'is_read': False},
+        {'title': '阿甘正传', 'year': 1994, 'is_read': False},
     ]
 
     user = User(name=name)
     db.session.add(user)
     for m in movies:
-        movie = Movie(title=m['title'], year=m['year'], is_read=m['is_read'])
+        movie = Movie(title=m['title'], year=m['year'], is_read=m['is_read'], user=user)
         db.session.add(movie)
+    db.session.commit()
+
+    # 随机数据用 executemany 分批插入
+    rows = (dict(row, user_id=user.id, title_key=normalize_title(row['title'])) for row in fake_movies(count, seed))
+    inserted = 0
+    while inserted < count:
+        batch = list(islice(rows, batch_size))
+        db.session.execute(db.insert(Movie), batch)
+        db.session.commit()
+        inserted += len(batch)
+        click.echo('Generated %d movies...' % inserted)
 
+    bump_version()
     db.session.commit()
     click.echo('Done.')
 
 
-@app.cli.command()
+@cli.command()
 @click.option('--username', prompt=True, help='The username used to login.')
 @click.option('--password', prompt=True, hide_input=True, confirmation_prompt=True, help='The password used to login.')
 def admin(username, password):
     """Create user."""
     db.create_all()
 
-    user = User.query.first()
+    # 按用户名查找（唯一索引）；没有时认领 forge 生成的、还没有用户名的用户
+    user = User.query.filter_by(username=username).first() \
+        or User.query.filter_by(username=None).order_by(User.id).first()
     if user is not None:
         click.echo('Updating user...')
         user.username = username
@@ -75,5 +129,433 @@ def admin(username, password):
         db.session.add(user)
 
     db.session.commit()
+    invalidate_profiles()
     click.echo('Done.')
 
+
+def _get_user(username):
+    # 导入导出针对的用户，默认是第一个用户（清单主人）
+    if username is None:
+        user = User.query.order_by(User.id).first()
+    else:
+        user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.UsageError('User %s does not exist.' % (username or ''))
+    return user
+
+
+# 旧版本没有的列 -> 添加列时使用的定义
+ADDED_COLUMNS = {
+    'user_id': 'INTEGER REFERENCES "user" (id)',
+    'title_key': 'VARCHAR(60)',
+    'created_at': 'DATETIME',
+    'updated_at': 'DATETIME',
+    'seq': 'INTEGER',
+    'details': 'TEXT',
+    'link_site': 'VARCHAR(20)',
+    'link_url': 'VARCHAR(255)',
+}
+
+# 旧版本建立、已被以 user_id 开头的复合索引取代的索引
+OBSOLETE_INDEXES = ['ix_movie_title', 'ix_movie_year', 'ix_movie_is_read',
+                    'ix_movie_title_year', 'ix_movie_is_read_year', 'ix_movie_user_is_read_year']
+
+
+@cli.command('upgrade-db')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows copied per transaction.')
+def upgrade_db(batch_size):
+    """Upgrade an existing database to the current schema."""
+    db.create_all()    # 创建缺少的表
+    table = Movie.__table__
+    inspector = db.inspect(db.engine)
+    old_exists = inspector.has_table('movie_old')
+    columns = {c['name']: str(c['type']).upper()
+               for c in inspector.get_columns('movie_old' if old_exists else 'movie')}
+
+    # 旧版本的 counter.value 是 INTEGER，在 PostgreSQL 和 MySQL 中放不下版本号；
+    # SQLite 的 INTEGER 本来就是 64 位，不需要修改
+    value_type = {c['name']: str(c['type']).upper() for c in inspector.get_columns('counter')}['value']
+    if value_type == 'INTEGER' and db.engine.dialect.name in ('postgresql', 'mysql'):
+        click.echo('Converting counter.value to BIGINT...')
+        db.session.execute(db.text('ALTER TABLE counter ALTER COLUMN value TYPE BIGINT'
+                                   if db.engine.dialect.name == 'postgresql' else
+                                   'ALTER TABLE counter MODIFY value BIGINT NOT NULL'))
+        db.session.commit()
+
+    rebuilt = False
+    if db.engine.dialect.name == 'sqlite' and (columns['year'] != 'INTEGER' or old_exists):
+        # SQLite 不能直接修改列类型：把旧表改名，建新表后分批复制
+        if not old_exists:
+            click.echo('Converting movie.year to INTEGER...')
+            db.session.execute(db.text('ALTER TABLE movie RENAME TO movie_old'))
+            db.session.execute(db.schema.CreateTable(table))
+            db.session.commit()
+        else:
+            click.echo('Resuming interrupted upgrade...')    # 上次中断时新表中已有的数据保留
+
+        last_id = db.session.execute(db.text('SELECT coalesce(max(id), 0) FROM movie')).scalar()
+        copied = 0
+        while True:
+            # 整个复制过程在 SQL 中完成，不把记录加载到 Python 内存
+            result = db.session.execute(db.text(
+                'INSERT INTO movie (id, title, year, is_read, user_id) '
+                'SELECT id, title, '
+                "CASE WHEN trim(year) GLOB '[0-9]*' THEN CAST(trim(year) AS INTEGER) END, "
+                'is_read, %s FROM movie_old WHERE id > :last_id ORDER BY id LIMIT :size'
+                % ('user_id' if 'user_id' in columns else 'NULL')),
+                dict(last_id=last_id, size=batch_size))
+            if result.rowcount <= 0:
+                break
+            copied += result.rowcount
+            last_id = db.session.execute(db.text('SELECT max(id) FROM movie')).scalar()
+            db.session.commit()
+            click.echo('Copied %d rows...' % copied)
+
+        db.session.execute(db.text('DROP TABLE movie_old'))
+        db.session.commit()
+        rebuilt = True
+    else:
+        for name, definition in ADDED_COLUMNS.items():
+            if name not in columns:
+                click.echo('Adding movie.%s...' % name)
+                db.session.execute(db.text('ALTER TABLE movie ADD COLUMN %s %s' % (name, definition)))
+                db.session.commit()
+
+    # 旧版本只有一个用户，没有所属用户的电影分批归到第一个用户名下
+    owner = db.session.execute(db.select(db.func.min(User.id))).scalar()
+    if owner is not None:
+        assigned = 0
+        while True:
+            result = db.session.execute(db.text(
+                'UPDATE movie SET user_id = :owner WHERE id IN '
+                '(SELECT id FROM movie WHERE user_id IS NULL LIMIT :size)'),
+                dict(owner=owner, size=batch_size))
+            db.session.commit()
+            if result.rowcount <= 0:
+                break
+            assigned += result.rowcount
+            click.echo('Assigned %d movies to user %d...' % (assigned, owner))
+
+    # 规范化标题需要在 Python 中计算，按 id 分批回填
+    last_id, normalized = 0, 0
+    while True:
+        rows = db.session.execute(db.text(
+            'SELECT id, title FROM movie WHERE id > :last_id AND title_key IS NULL AND title IS NOT NULL '
+            'ORDER BY id LIMIT :size'), dict(last_id=last_id, size=batch_size)).all()
+        if not rows:
+            break
+        db.session.execute(db.text('UPDATE movie SET title_key = :key WHERE id = :id'),
+                           [dict(id=row.id, key=normalize_title(row.title)) for row in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        normalized += len(rows)
+        click.echo('Normalized %d titles...' % normalized)
+
+    # 旧的电影没有变更序号，按 id 顺序分配，客户端第一次同步时会收到它们
+    for assigned in backfill_changes(batch_size):
+        click.echo('Assigned change sequence to %d movies...' % assigned)
+
+    # 建立缺少的索引，删除被取代的旧索引，并更新查询优化器的统计信息
+    for model in (User, Movie):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    for name in OBSOLETE_INDEXES:
+        db.session.execute(db.text('DROP INDEX IF EXISTS %s' % name))
+    # 重建表后旧的触发器已随旧表删除，需要重新创建并回填全文索引
+    if create_search_index(db.session.connection()) or rebuilt:
+        db.session.commit()
+        _index_search(batch_size)
+    if create_stats_table(db.session.connection()) or rebuilt:
+        rebuild_stats()
+    create_change_triggers(db.session.connection())
+    db.session.execute(db.text('ANALYZE'))
+    bump_version()
+    db.session.commit()
+    click.echo('Upgraded database.')
+
+
+def _index_search(batch_size):
+    indexed = 0
+    for indexed in rebuild_search_index(batch_size):
+        click.echo('Indexed %d titles...' % indexed)
+    return indexed
+
+
+@cli.command('index-search')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows indexed per transaction.')
+def index_search(batch_size):
+    """Rebuild the full-text search index."""
+    db.create_all()
+    if not is_sqlite(db.session.connection()):
+        click.echo('Full-text search requires SQLite.')
+        return
+    create_search_index(db.session.connection())
+    db.session.commit()
+    indexed = _index_search(batch_size)
+    click.echo('Indexed %d titles.' % indexed)
+
+
+@cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recalculate the watchlist statistics table."""
+    db.create_all()
+    if not is_sqlite(db.session.connection()):
+        click.echo('Statistics are calculated on the fly for this database.')
+        return
+    create_stats_table(db.session.connection())
+    rows = rebuild_stats()
+    bump_version()
+    db.session.commit()
+    click.echo('Rebuilt statistics (%d groups).' % rows)
+
+
+@cli.command()
+@click.option('--merge', is_flag=True, help='Keep the oldest movie of each cluster and delete the others.')
+@click.option('--batch-size', default=500, show_default=True, help='Clusters merged per transaction.')
+def dedupe(merge, batch_size):
+    """Report or merge movies with the same normalized title and year."""
+    clusters = list(duplicate_clusters())    # 先读完再修改，只保存重复记录的 id
+    for user_id, ids in clusters:
+        movie = db.session.get(Movie, ids[0])
+        click.echo('User %d: %s (%s) x%d, ids %s' % (
+            user_id, movie.title, movie.year, len(ids), ', '.join(map(str, ids))))
+
+    if merge and clusters:
+        deleted = 0
+        for start in range(0, len(clusters), batch_size):
+            for user_id, ids in clusters[start:start + batch_size]:
+                deleted += merge_cluster(ids)
+            bump_version()
+            db.session.commit()
+        click.echo('Merged %d clusters, deleted %d movies.' % (len(clusters), deleted))
+    else:
+        click.echo('Found %d duplicate clusters.' % len(clusters))
+
+
+@cli.command('prune-tombstones')
+@click.option('--days', default=90, show_default=True, help='Keep deletions newer than this many days.')
+def prune_tombstones_command(days):
+    """Delete old deletion records used by the change feed."""
+    count = prune_tombstones(datetime.utcnow() - timedelta(days=days))
+    db.session.commit()
+    click.echo('Pruned %d tombstones.' % count)
+
+
+@cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'json']), help='File format, guessed from the name by default.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows inserted per transaction.')
+@click.option('--user', 'username', help='Username of the list owner, the first user by default.')
+def import_command(file, fmt, batch_size, username):
+    """Import movies from a CSV, JSON Lines or JSON array file."""
+    db.create_all()
+    user = _get_user(username)
+    fmt = fmt or guess_format(file.name)
+    start = time.perf_counter()
+    read = inserted = invalid = 0
+    try:
+        for read, inserted, invalid in import_movies(read_rows(file, fmt), user.id, batch_size):
+            elapsed = time.perf_counter() - start
+            click.echo('Read %d rows, inserted %d (%.0f rows/s)...' % (read, inserted, read / elapsed), err=True)
+    except ValueError as e:    # JSON 数组文件无法解析，这时还没有插入任何数据
+        raise click.ClickException('Invalid %s file: %s' % (fmt, e))
+
+    bump_version(user.id)
+    db.session.commit()
+    elapsed = time.perf_counter() - start
+    click.echo('Imported %d movies, skipped %d duplicates and %d invalid rows in %.2fs (%.0f rows/s).' % (
+        inserted, read - inserted - invalid, invalid, elapsed, read / elapsed if elapsed else 0))
+
+
+@cli.command('export')
+@click.argument('file', type=click.File('w', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'json']), help='File format, guessed from the name by default.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows read per query.')
+@click.option('--user', 'username', help='Username of the list owner, the first user by default.')
+def export_command(file, fmt, batch_size, username):
+    """Export movies to a CSV, JSON Lines or JSON array file."""
+    user = _get_user(username)
+    fmt = fmt or guess_format(file.name)
+    start = time.perf_counter()
+    count = write_rows(file, iter_movies(user.id, batch_size), fmt)
+    elapsed = time.perf_counter() - start
+    click.echo('Exported %d movies in %.2fs (%.0f rows/s).' % (
+        count, elapsed, count / elapsed if elapsed else 0), err=True)
+
+
+@cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files."""
+    if brotli is None:
+        click.echo('brotli is not installed, only gzip files will be written.')
+    results = build_assets()
+    for filename, hashed, encodings in results:
+        click.echo('%s -> %s %s' % (filename, hashed, ' '.join(encodings)))
+    click.echo('Built %d assets.' % len(results))
+
+
+def _database_path():
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise click.UsageError('Backup and restore only support SQLite database files.')
+    return url.database
+
+
+def _progress(action):
+    # 每复制 10% 输出一次进度
+    reported = [-1]
+
+    def progress(copied, total):
+        percent = copied * 10 // total * 10 if total else 100
+        if percent > reported[0]:
+            reported[0] = percent
+            click.echo('%s %d%%...' % (action, percent), err=True)
+    return progress
+
+
+@cli.command()
+@click.argument('file', type=click.Path(dir_okay=False, writable=True))
+@click.option('--check', is_flag=True, help='Run an integrity check on the backup.')
+@click.option('--pages', default=PAGES_PER_STEP, show_default=True, help='Pages copied per step.')
+@click.option('--sleep', default=0.0, show_default=True, help='Seconds to pause between steps.')
+def backup(file, check, pages, sleep):
+    """Back up the database while it is in use, compressed if FILE ends with .gz."""
+    result = backup_database(_database_path(), file, pages, sleep, _progress('Copied'))
+    click.echo('Backed up %d pages (%.1f MiB) in %.2fs (%.1f MiB/s) to %s.' % (
+        result.pages, result.bytes / 1024 / 1024, result.elapsed, result.throughput, file))
+    if check:
+        path, cleanup = open_backup(file)
+        try:
+            errors = check_integrity(path)
+        finally:
+            cleanup()
+        if errors:
+            raise click.ClickException('Integrity check failed: %s' % '; '.join(errors[:10]))
+        click.echo('Integrity check passed.')
+
+
+@cli.command()
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--check/--no-check', default=True, show_default=True, help='Check the backup before restoring.')
+@click.confirmation_option(prompt='This will replace the current database. Continue?')
+def restore(file, check):
+    """Replace the database with a backup made by the backup command."""
+    target = _database_path()
+    path, cleanup = open_backup(file)
+    try:
+        errors = check_integrity(path) if check else []
+        if errors:
+            raise click.ClickException('Integrity check failed: %s' % '; '.join(errors[:10]))
+        last_seq = db.session.get(Counter, SEQ_KEY)
+        last_seq = last_seq.value if last_seq is not None else 0
+        db.session.remove()
+        db.engine.dispose()    # 关闭连接池中的连接，恢复后重新连接
+        result = restore_database(path, target, progress=_progress('Restored'))
+    finally:
+        cleanup()
+
+    # 恢复的数据库中的版本号和变更序号可能比现在小，缓存和客户端的同步点都要作废
+    reset_version()
+    expire_changes(last_seq)
+    db.session.commit()
+    invalidate_profiles()
+    click.echo('Restored %d pages (%.1f MiB) in %.2fs (%.1f MiB/s) from %s.' % (
+        result.pages, result.bytes / 1024 / 1024, result.elapsed, result.throughput, file))
+
+
+jobs = AppGroup('jobs', help='Manage background jobs.')
+cli.add_command(jobs)
+
+
+def _job_line(job):
+    total = '/%d' % job.total if job.total is not None else ''
+    line = '#%d %s %s %d%s (attempt %d/%d)' % (
+        job.id, job.kind, job.status, job.progress, total, job.attempts, job.max_attempts)
+    if job.status == 'done':
+        line += ' %s' % job.result
+    elif job.error:
+        line += ' %s' % job.error
+    return line
+
+
+def _param(value):
+    # key=value 形式的参数，值按 JSON 解析，解析失败时作为字符串
+    key, sep, value = value.partition('=')
+    if not sep:
+        raise click.BadParameter('Expected key=value: %s' % key)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+@jobs.command('list')
+@click.option('--status', type=click.Choice(['queued', 'running', 'done', 'failed', 'cancelled']))
+@click.option('--limit', default=20, show_default=True)
+def list_jobs(status, limit):
+    """List the most recent jobs."""
+    query = Job.query.order_by(Job.id.desc())
+    if status:
+        query = query.filter_by(status=status)
+    for job in query.limit(limit):
+        click.echo(_job_line(job))
+
+
+@jobs.command('submit')
+@click.argument('kind')
+@click.option('--param', '-p', 'params', multiple=True, help='Job parameter as key=value, repeatable.')
+@click.option('--user', 'username', help='Username of the list owner, the first user by default.')
+@click.option('--max-attempts', default=3, show_default=True)
+def submit_job(kind, params, username, max_attempts):
+    """Queue a job, e.g. `flask jobs submit import -p path=movies.csv`."""
+    handlers = load_handlers()
+    if kind not in handlers:
+        raise click.UsageError('Unknown job kind %s, expected one of: %s.' % (kind, ', '.join(sorted(handlers))))
+    params = dict(_param(value) for value in params)
+    if 'path' in params:    # 任务可能在其他进程中执行
+        params['path'] = os.path.abspath(params['path'])
+    user_id = None
+    if 'user_id' in inspect.signature(handlers[kind]).parameters:
+        user_id = params.setdefault('user_id', _get_user(username).id)
+    job = enqueue(kind, params, user_id=user_id, max_attempts=max_attempts)
+    click.echo('Queued job #%d.' % job.id)
+
+
+@jobs.command('work')
+@click.option('--forever', is_flag=True, help='Keep waiting for new jobs instead of exiting when the queue is empty.')
+def work_jobs(forever):
+    """Run queued jobs in this process."""
+    count = 0
+    while True:
+        job_id = claim_next()
+        if job_id is None:
+            if not forever:
+                break
+            time.sleep(current_app.config['WATCHLIST_JOB_POLL'])
+            continue
+        click.echo(_job_line(run_job(job_id)))
+        count += 1
+    click.echo('Ran %d jobs.' % count)
+
+
+def _get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        raise click.UsageError('Job %d does not exist.' % job_id)
+    return job
+
+
+@jobs.command('cancel')
+@click.argument('job_id', type=int)
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    job = _get_job(job_id)
+    click.echo(_job_line(job) if cancel(job) else 'Job #%d has already finished.' % job_id)
+
+
+@jobs.command('retry')
+@click.argument('job_id', type=int)
+def retry_job(job_id):
+    """Queue a failed or cancelled job again."""
+    job = _get_job(job_id)
+    click.echo(_job_line(job) if retry(job) else 'Job #%d has not failed.' % job_id)
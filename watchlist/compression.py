@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+
+from flask import Blueprint, current_app, g, request
+
+from watchlist.assets import brotli
+
+bp = Blueprint('compression', __name__)
+
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/css', 'text/javascript',
+                'application/json', 'application/javascript'}
+
+
+def _encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['WATCHLIST_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['WATCHLIST_COMPRESS_LEVEL'])
+
+
+def choose_encoding(accept_encodings):
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding]:    # q=0 表示不接受
+            return encoding
+    return None
+
+
+@bp.after_app_request
+def compress_response(response):
+    # 只处理完整生成的 GET 页面（包括错误页面）：跳过流式响应、文件、重定向和已经压缩过的响应
+    if request.method not in ('GET', 'HEAD') \
+            or not (response.status_code == 200 or response.status_code >= 400) \
+            or response.direct_passthrough or response.is_streamed \
+            or response.mimetype not in COMPRESSIBLE \
+            or 'Content-Encoding' in response.headers:
+        return response
+
+    # 没有校验值的页面用内容哈希生成弱 ETag，内容未变时返回 304；关闭压缩时也生效。
+    # 已有 ETag 的响应（例如 API）已经自己处理过条件请求，不再检查。
+    # 页面缓存中的页面（见 cache.cached_page）已经算好哈希和压缩结果，直接使用
+    page = g.get('cached_page')
+    data = response.get_data()
+    if response.status_code == 200 and response.get_etag()[0] is None:
+        response.set_etag(page.etag if page is not None else hashlib.sha1(data).hexdigest()[:20], weak=True)
+        response.make_conditional(request)
+    if not current_app.config['WATCHLIST_COMPRESS_ENABLED']:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code == 304 or len(data) < current_app.config['WATCHLIST_COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if page is not None:
+        body = page.encoded.get(encoding)
+        if body is None:
+            body = page.encoded[encoding] = _encode(data, encoding)
+    else:
+        body = _encode(data, encoding)
+    response.set_data(body)
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:    # 压缩后的字节不同，强 ETag 改为弱 ETag
+        response.set_etag(etag, weak=True)
+    return response
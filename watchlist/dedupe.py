@@ -0,0 +1,76 @@
+from difflib import SequenceMatcher
+
+from watchlist import db
+from watchlist.models import Movie, normalize_title
+from watchlist.search import MIN_TERM_LENGTH
+from watchlist.engine import is_sqlite
+
+SIMILARITY = 0.85    # 规范化标题的相似度达到这个值时视为可能重复
+MAX_CANDIDATES = 200    # 全文索引返回的候选数量上限
+YEAR_TOLERANCE = 1    # 年份相差超过 1 年的同名电影（例如翻拍）不算重复
+
+
+def similarity(a, b):
+    matcher = SequenceMatcher(None, a, b)
+    if matcher.real_quick_ratio() < SIMILARITY or matcher.quick_ratio() < SIMILARITY:
+        return 0.0
+    return matcher.ratio()
+
+
+def _fuzzy_candidate_ids(user_id, title):
+    # 只有一处笔误的标题，前半段或后半段一定和原标题完全相同：
+    # 用 trigram 全文索引查找包含其中一段的标题，子串查询只访问索引
+    text = title.strip()
+    middle = len(text) // 2
+    halves = [half.strip() for half in (text[:middle], text[middle:])]
+    halves = [half for half in halves if len(half) >= MIN_TERM_LENGTH]
+    if not halves or not is_sqlite(db.session.connection()):
+        return []
+    match = ' OR '.join('"%s"' % half.replace('"', '""') for half in halves)
+    # CROSS JOIN 固定由全文索引驱动，原因见 search_movies()
+    return [row[0] for row in db.session.execute(db.text(
+        'SELECT movie.id FROM movie_fts CROSS JOIN movie ON movie.id = movie_fts.rowid '
+        'WHERE movie_fts MATCH :match AND movie.user_id = :user_id LIMIT :limit'),
+        dict(match=match, user_id=user_id, limit=MAX_CANDIDATES))]
+
+
+def find_duplicates(user_id, title, year=None, exclude_id=None, limit=5):
+    # user_id 清单中可能和 title 重复的电影，最相似的在前：
+    # 规范化标题相同的用 (user_id, title_key) 索引查找，笔误用全文索引查找候选后比较
+    key = normalize_title(title)
+    query = Movie.query.filter(Movie.user_id == user_id)
+    if exclude_id is not None:
+        query = query.filter(Movie.id != exclude_id)
+    found = {movie.id: (1.0, movie) for movie in query.filter(Movie.title_key == key).limit(limit)}
+
+    ids = [i for i in _fuzzy_candidate_ids(user_id, title) if i not in found and i != exclude_id]
+    if ids:
+        for movie in Movie.query.filter(Movie.id.in_(ids)):
+            score = similarity(key, movie.title_key or normalize_title(movie.title or ''))
+            if score >= SIMILARITY:
+                found[movie.id] = (score, movie)
+
+    results = [(score, movie) for score, movie in found.values()
+               if year is None or movie.year is None or abs(movie.year - year) <= YEAR_TOLERANCE]
+    results.sort(key=lambda item: (-item[0], item[1].id))
+    return [movie for score, movie in results[:limit]]
+
+
+def duplicate_clusters():
+    # 规范化标题和年份都相同的电影分组 (user_id, [id, ...])，组内按 id 排序；
+    # 按 (user_id, title_key, year) 索引的顺序分组，不需要临时排序
+    rows = db.session.execute(db.text(
+        'SELECT user_id, group_concat(id) AS ids FROM movie '
+        'WHERE user_id IS NOT NULL AND title_key IS NOT NULL '
+        'GROUP BY user_id, title_key, year HAVING count(*) > 1'))
+    for row in rows:
+        yield row.user_id, sorted(int(i) for i in row.ids.split(','))
+
+
+def merge_cluster(ids):
+    # 保留最早添加的一条，任一条已阅则保留的记录标为已阅，删除其余的，返回删除的数量
+    keep, others = ids[0], ids[1:]
+    is_read = db.session.execute(
+        db.select(db.func.max(Movie.is_read)).where(Movie.id.in_(ids))).scalar()
+    db.session.execute(db.update(Movie).where(Movie.id == keep).values(is_read=bool(is_read)))
+    return db.session.execute(db.delete(Movie).where(Movie.id.in_(others))).rowcount
@@ -0,0 +1,62 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# 每个 SQLite 连接建立时执行的 PRAGMA：
+# WAL 让读不再被写阻塞，busy_timeout 让写操作等待锁而不是直接报 "database is locked"
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),    # 毫秒
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),    # 字节
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),    # 负数表示 KiB
+    'temp_store': 'MEMORY',
+}
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri, pragmas=SQLITE_PRAGMAS):
+    # 连接池配置，适用于多线程服务器（例如 gunicorn --threads）；
+    # pragmas 是实际使用的 PRAGMA，sqlite3 连接的等待时间和其中的 busy_timeout 一致
+    pool = dict(
+        pool_size=int(os.getenv('DATABASE_POOL_SIZE', 10)),
+        max_overflow=int(os.getenv('DATABASE_MAX_OVERFLOW', 20)),
+        pool_timeout=int(os.getenv('DATABASE_POOL_TIMEOUT', 30)),
+    )
+    if make_url(uri).get_backend_name() != 'sqlite':
+        # 其他数据库：检测失效连接，定期回收长连接
+        return dict(pool, pool_pre_ping=True, pool_recycle=int(os.getenv('DATABASE_POOL_RECYCLE', 1800)))
+    if is_memory_sqlite(uri):
+        return {}    # 内存数据库由 Flask-SQLAlchemy 使用单个共享连接
+    return dict(pool, connect_args=dict(check_same_thread=False,
+                                        timeout=pragmas.get('busy_timeout', SQLITE_PRAGMAS['busy_timeout']) / 1000))
+
+
+def is_sqlite(connection):
+    # 全文索引、统计表和变更记录的触发器只在 SQLite 中使用
+    return connection.dialect.name == 'sqlite'
+
+
+def attach_to_table(table, create, drop=None):
+    # create(connection) 和 drop(connection) 创建、删除依附于 table 的 SQLite 对象，
+    # 随 table 一起创建（create_all）和删除（drop_all）；删除表时触发器自动删除，不需要 drop
+    event.listen(table, 'after_create', lambda target, connection, **kw: create(connection))
+    if drop is not None:
+        event.listen(table, 'before_drop', lambda target, connection, **kw: drop(connection))
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
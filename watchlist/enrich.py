@@ -0,0 +1,69 @@
+import abc
+import json
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from flask import current_app
+from werkzeug.utils import import_string
+
+from watchlist.models import normalize_title
+
+
+class Provider(abc.ABC):
+    # 电影资料来源：lookup() 返回 dict(site, url, rating, plot, poster) 中的部分字段，找不到时返回 None；
+    # 网络错误等直接抛出异常，由任务重试。没有实现 lookup() 的子类不能实例化
+
+    @abc.abstractmethod
+    def lookup(self, title, year=None):
+        pass
+
+
+class StaticProvider(Provider):
+    # 从本地字典查找，键为规范化的标题，或 (规范化的标题, 年份)；用于测试和离线环境
+
+    def __init__(self, data):
+        self.data = {}
+        for key, info in data.items():
+            if isinstance(key, tuple):
+                self.data[(normalize_title(key[0]), key[1])] = info
+            else:
+                self.data[normalize_title(key)] = info
+
+    def lookup(self, title, year=None):
+        key = normalize_title(title)
+        return self.data.get((key, year)) or self.data.get(key)
+
+
+class OMDbProvider(Provider):
+    # OMDb API（https://www.omdbapi.com/），需要在 WATCHLIST_OMDB_API_KEY 中设置 API key
+    URL = 'https://www.omdbapi.com/'
+
+    def __init__(self, api_key=None, timeout=10):
+        self.api_key = api_key or current_app.config['WATCHLIST_OMDB_API_KEY']
+        self.timeout = timeout
+        if not self.api_key:
+            raise RuntimeError('WATCHLIST_OMDB_API_KEY is not set.')
+
+    def lookup(self, title, year=None):
+        params = dict(t=title, type='movie', apikey=self.api_key)
+        if year:
+            params['y'] = year
+        with urlopen('%s?%s' % (self.URL, urlencode(params)), timeout=self.timeout) as response:
+            data = json.load(response)
+        if data.get('Response') != 'True':
+            return None
+        rating = data.get('imdbRating')
+        return dict(site='imdb', url='https://www.imdb.com/title/%s/' % data['imdbID'],
+                    rating=float(rating) if rating and rating != 'N/A' else None,
+                    plot=data.get('Plot'), poster=data.get('Poster'))
+
+
+def get_provider():
+    # WATCHLIST_ENRICH_PROVIDER 可以是 "模块:类" 形式的导入路径，也可以直接是 Provider 对象；
+    # 为空时不获取资料
+    provider = current_app.config['WATCHLIST_ENRICH_PROVIDER']
+    if not provider:
+        return None
+    if isinstance(provider, str):
+        provider = import_string(provider)
+    return provider() if isinstance(provider, type) else provider
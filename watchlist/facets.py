@@ -0,0 +1,119 @@
+from flask import url_for
+
+from watchlist.models import Movie, to_bool
+from watchlist.pagination import decode_cursor, keyset_condition, keyset_order, keyset_paginate
+from watchlist.stats import stats_rows
+
+# 排序方式 -> (排序列, 是否倒序)。每种排序加上 is_read 和年份范围筛选，
+# 都有以 user_id 开头的索引可以直接按顺序范围扫描，不需要临时排序
+SORTS = {
+    'added': ((Movie.id,), False),
+    '-added': ((Movie.id,), True),
+    'year': ((Movie.year, Movie.id), False),
+    '-year': ((Movie.year, Movie.id), True),
+    'title': ((Movie.title, Movie.year, Movie.id), False),
+}
+
+
+def parse_filters(args):
+    # 从查询参数解析筛选和排序条件，无效时抛出 ValueError
+    filters = dict(is_read=None, year_from=None, year_to=None, sort=args.get('sort') or 'added')
+    if filters['sort'] not in SORTS:
+        raise ValueError('Invalid sort.')
+    try:
+        if args.get('is_read'):
+            filters['is_read'] = to_bool(args['is_read'])
+    except ValueError:
+        raise ValueError('Invalid is_read.') from None
+    for name in ('year_from', 'year_to', 'year', 'decade'):
+        value = args.get(name)
+        if not value:
+            continue
+        # 年份最多四位，和 validate_movie() 一致；isdigit() 也接受非 ASCII 数字
+        if not (value.isascii() and value.isdigit()) or len(value) > 4:
+            raise ValueError('Invalid %s.' % name)
+        value = int(value)
+        if name == 'year':    # year=1994 和 decade=1990 是年份范围的简写
+            filters['year_from'] = filters['year_to'] = value
+        elif name == 'decade':
+            filters['year_from'], filters['year_to'] = value, value + 9
+        else:
+            filters[name] = value
+    return filters
+
+
+def filter_query(query, user_id, filters):
+    query = query.filter(Movie.user_id == user_id)
+    if filters['is_read'] is not None:
+        query = query.filter(Movie.is_read == filters['is_read'])
+    # 不按年份排序时，年份范围只在按排序索引扫描时过滤；写成 year + 0 让 SQLite 不去选择
+    # 年份索引，否则取出范围内的所有记录后还要临时排序，翻页越往后越慢
+    year = Movie.year if filters['sort'] in ('year', '-year') else Movie.year + 0
+    if filters['year_from'] is not None:
+        query = query.filter(year >= filters['year_from'])
+    if filters['year_to'] is not None:
+        query = query.filter(year <= filters['year_to'])
+    return query
+
+
+def _keyset_query(query, user_id, filters, after, before):
+    columns, descending = SORTS[filters['sort']]
+    query = filter_query(query, user_id, filters)
+    if filters['sort'] in ('year', '-year') and after is None and before is None:
+        # 游标不能包含 NULL，没有年份的电影不参与按年份排序；
+        # 有游标时行值比较已经排除了 NULL，不再重复这个条件，以免影响索引范围的选择
+        query = query.filter(Movie.year.isnot(None))
+    return query, columns, descending
+
+
+def paginate_movies(user_id, filters, args):
+    # 按筛选条件和排序分页，游标无效时抛出 ValueError
+    columns = SORTS[filters['sort']][0]
+    after = decode_cursor(args.get('after'), columns)
+    before = decode_cursor(args.get('before'), columns)
+    query, columns, descending = _keyset_query(Movie.query, user_id, filters, after, before)
+    return keyset_paginate(query, columns, after=after, before=before,
+                           limit=args.get('limit', type=int), descending=descending)
+
+
+def sorted_statement(statement, user_id, filters, after=None):
+    # 流式输出使用的查询，排序和分页一致
+    after = decode_cursor(after, SORTS[filters['sort']][0])
+    statement, columns, descending = _keyset_query(statement, user_id, filters, after, None)
+    if after is not None:
+        statement = statement.filter(keyset_condition(columns, after, descending))
+    return statement.order_by(*keyset_order(columns, descending))
+
+
+def get_facets(user_id, filters):
+    return facet_counts(stats_rows(user_id), filters)
+
+
+def facet_counts(rows, filters):
+    # 每个筛选项的数量：已阅/未阅按当前年份范围计数，年代按当前已阅筛选计数；
+    # 从按版本号缓存的统计行计算，不查询 movie 表
+
+    def in_range(year):
+        if filters['year_from'] is None and filters['year_to'] is None:
+            return True
+        return year is not None and (filters['year_from'] or 0) <= year <= (filters['year_to'] or year)
+
+    is_read, decades, total = {True: 0, False: 0}, {}, 0
+    for year, read, count in rows:
+        matches_status = filters['is_read'] is None or read == filters['is_read']
+        if in_range(year):
+            is_read[read] += count
+            total += count if matches_status else 0
+        if matches_status:
+            decade = year - year % 10 if year else None
+            decades[decade] = decades.get(decade, 0) + count
+    keys = sorted(decades, key=lambda key: (key is None, -(key or 0)))
+    return dict(total=total, is_read=dict(true=is_read[True], false=is_read[False]),
+                decades=[dict(decade=key, count=decades[key]) for key in keys])
+
+
+def filter_url(endpoint, args, **changes):
+    # 修改筛选条件的链接：保留其他查询参数，去掉分页游标，值为 None 的参数被删除
+    values = {key: value for key, value in args.items() if key not in ('after', 'before')}
+    values.update(changes)
+    return url_for(endpoint, **{key: value for key, value in values.items() if value is not None})
@@ -0,0 +1,216 @@
+import json
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app
+
+from watchlist import db
+from watchlist.models import Job
+
+HANDLERS = {}    # 任务类型 -> 处理函数，见 tasks.py
+FINISHED = ('done', 'failed', 'cancelled')
+
+bp = Blueprint('jobs', __name__)
+
+
+def handler(kind):
+    # 注册任务处理函数：fn(context, **params)，返回值（可以 JSON 序列化）保存为任务结果
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def load_handlers():
+    from watchlist import tasks    # noqa: F401  导入时注册处理函数
+    return HANDLERS
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    # 传给处理函数，用来报告进度；检查到取消请求时抛出 JobCancelled
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.attempt = job.attempts
+
+    def progress(self, done, total=None):
+        # 更新进度和心跳并提交当前事务，只应在一批数据处理完成后调用
+        values = dict(progress=done, heartbeat_at=datetime.utcnow())
+        if total is not None:
+            values['total'] = total
+        db.session.execute(db.update(Job).where(Job.id == self.job_id).values(**values))
+        db.session.commit()
+        if db.session.execute(db.select(Job.cancel_requested).where(Job.id == self.job_id)).scalar():
+            raise JobCancelled()
+
+
+def enqueue(kind, params=None, user_id=None, max_attempts=3):
+    # 添加任务并提交，唤醒本进程的执行线程，返回任务
+    if kind not in load_handlers():
+        raise ValueError('Unknown job kind: %s' % kind)
+    job = Job(kind=kind, params=json.dumps(params or {}), user_id=user_id,
+              max_attempts=max_attempts, created_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    runner.notify()
+    return job
+
+
+def cancel(job):
+    # 还没开始的任务直接取消，执行中的任务在下一次报告进度时停止；返回是否可以取消
+    if job.status in FINISHED:
+        return False
+    if job.status == 'queued':
+        job.status, job.finished_at = 'cancelled', datetime.utcnow()
+    job.cancel_requested = True
+    db.session.commit()
+    return True
+
+
+def retry(job):
+    # 把失败或取消的任务重新放回队列，重新计算尝试次数
+    if job.status not in ('failed', 'cancelled'):
+        return False
+    job.status, job.attempts, job.progress, job.cancel_requested, job.run_after = 'queued', 0, 0, False, None
+    job.error = job.result = job.finished_at = None
+    db.session.commit()
+    runner.notify()
+    return True
+
+
+def claim_next():
+    # 领取下一个待执行的任务，返回任务 id，没有时返回 None。
+    # 心跳超时的执行中任务（执行它的进程已经退出）也可以被重新领取。
+    # 用带原状态的 UPDATE 领取，多个线程或进程同时领取同一个任务时只有一个成功
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['WATCHLIST_JOB_TIMEOUT'])
+    while True:
+        row = db.session.execute(
+            db.select(Job.id, Job.status, Job.attempts, Job.max_attempts).where(db.or_(
+                db.and_(Job.status == 'queued', db.or_(Job.run_after.is_(None), Job.run_after <= now)),
+                db.and_(Job.status == 'running', Job.heartbeat_at < stale)))
+            .order_by(Job.id).limit(1)).first()
+        if row is None:
+            db.session.commit()
+            return None
+        condition = db.and_(Job.id == row.id, Job.status == row.status, Job.attempts == row.attempts)
+        if row.status == 'running' and row.attempts >= row.max_attempts:
+            db.session.execute(db.update(Job).where(condition).values(
+                status='failed', error='Worker stopped responding.', finished_at=now))
+            db.session.commit()
+            continue
+        result = db.session.execute(db.update(Job).where(condition).values(
+            status='running', attempts=Job.attempts + 1, started_at=now, heartbeat_at=now))
+        db.session.commit()
+        if result.rowcount == 1:
+            return row.id
+
+
+def run_job(job_id):
+    # 执行一个已领取的任务；失败时按 WATCHLIST_JOB_RETRY_DELAY 指数退避后重试
+    job = db.session.get(Job, job_id)
+    fn = load_handlers().get(job.kind)
+    try:
+        if fn is None:
+            raise ValueError('Unknown job kind: %s' % job.kind)
+        result = fn(JobContext(job), **json.loads(job.params or '{}'))
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, status='cancelled')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning('Job %d (%s) failed:\n%s', job_id, job.kind, traceback.format_exc())
+        job = db.session.get(Job, job_id)
+        error = '%s: %s' % (type(e).__name__, e)
+        if job.attempts < job.max_attempts and not job.cancel_requested:
+            delay = current_app.config['WATCHLIST_JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+            _finish(job_id, status='queued', error=error, finished_at=None,
+                    run_after=datetime.utcnow() + timedelta(seconds=delay))
+        else:
+            _finish(job_id, status='failed', error=error)
+    else:
+        _finish(job_id, status='done', result=json.dumps(result), error=None)
+    return db.session.get(Job, job_id)
+
+
+def _finish(job_id, **values):
+    values.setdefault('finished_at', datetime.utcnow())
+    db.session.execute(db.update(Job).where(Job.id == job_id).values(**values))
+    db.session.commit()
+
+
+def work(limit=None):
+    # 在当前线程中执行待执行的任务，直到队列为空或执行了 limit 个，返回执行的数量
+    count = 0
+    while limit is None or count < limit:
+        job_id = claim_next()
+        if job_id is None:
+            break
+        run_job(job_id)
+        count += 1
+    return count
+
+
+class JobRunner:
+    # 进程内的执行线程池：每个线程循环领取并执行任务，队列为空时等待通知或轮询间隔
+
+    def __init__(self):
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(app.config['WATCHLIST_JOB_WORKERS']):
+                thread = threading.Thread(target=self._loop, args=(app,), name='watchlist-job-%d' % i, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _loop(self, app):
+        with app.app_context():
+            while not self._stop.is_set():
+                try:
+                    ran = work(limit=1)
+                except Exception:
+                    app.logger.exception('Job runner error')
+                    ran = 0
+                finally:
+                    db.session.remove()
+                if not ran:
+                    self._wake.wait(app.config['WATCHLIST_JOB_POLL'])
+                    self._wake.clear()
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            self._stop.set()
+            self._wake.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+
+runner = JobRunner()
+
+
+@bp.before_app_request
+def start_runner():
+    # 在 Web 进程处理第一个请求时启动执行线程，命令行进程不会启动
+    if not runner.running and current_app.config['WATCHLIST_JOB_WORKERS'] > 0:
+        runner.start(current_app._get_current_object())
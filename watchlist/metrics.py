@@ -0,0 +1,191 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import Blueprint, current_app, g, request, has_request_context, abort, before_render_template, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from watchlist.cache import page_cache
+
+# 请求耗时直方图的桶（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Registry:
+    # 进程内的指标，多进程部署时每个 worker 各自统计
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = defaultdict(Histogram)    # 端点 -> 请求耗时
+        self.counters = defaultdict(float)    # (指标名, 端点) -> 累计值
+        self.timers = defaultdict(Histogram)    # 其他耗时（例如密码散列）
+
+    def record_request(self, endpoint, status, seconds, sql_count, sql_seconds, render_seconds, size):
+        with self._lock:
+            self.requests[endpoint].observe(seconds)
+            self.counters['responses_total', endpoint, str(status)] += 1
+            self.counters['sql_queries_total', endpoint] += sql_count
+            self.counters['sql_duration_seconds_total', endpoint] += sql_seconds
+            self.counters['template_render_seconds_total', endpoint] += render_seconds
+            if size is not None:
+                self.counters['response_bytes_total', endpoint] += size
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.timers[name].observe(seconds)
+
+    def render(self):
+        # Prometheus 文本格式
+        lines = []
+        with self._lock:
+            _histogram(lines, 'watchlist_request_duration_seconds', 'Request wall time.',
+                       'endpoint', self.requests)
+            _histogram(lines, 'watchlist_operation_duration_seconds', 'Time spent in instrumented operations.',
+                       'operation', self.timers)
+            counters = sorted(self.counters.items())
+
+        descriptions = dict(
+            responses_total='Responses by endpoint and status.',
+            sql_queries_total='SQL statements executed.',
+            sql_duration_seconds_total='Time spent executing SQL.',
+            template_render_seconds_total='Time spent rendering templates.',
+            response_bytes_total='Response body bytes sent.',
+        )
+        for name, help_text in descriptions.items():
+            lines.append('# HELP watchlist_%s %s' % (name, help_text))
+            lines.append('# TYPE watchlist_%s counter' % name)
+            for key, value in counters:
+                if key[0] != name:
+                    continue
+                labels = 'endpoint="%s"' % _escape(key[1])
+                if len(key) > 2:
+                    labels += ',status="%s"' % key[2]
+                lines.append('watchlist_%s{%s} %s' % (name, labels, _number(value)))
+
+        stats = page_cache.stats()
+        for name in ('hits', 'misses'):
+            lines.append('# TYPE watchlist_page_cache_%s_total counter' % name)
+            lines.append('watchlist_page_cache_%s_total %d' % (name, stats[name]))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _histogram(lines, name, help_text, label, histograms):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for key, histogram in sorted(histograms.items()):
+        key = _escape(key)
+        for bound, count in zip(BUCKETS, histogram.buckets):
+            lines.append('%s_bucket{%s="%s",le="%s"} %d' % (name, label, key, bound, count))
+        lines.append('%s_bucket{%s="%s",le="+Inf"} %d' % (name, label, key, histogram.count))
+        lines.append('%s_sum{%s="%s"} %s' % (name, label, key, _number(histogram.sum)))
+        lines.append('%s_count{%s="%s"} %d' % (name, label, key, histogram.count))
+
+
+registry = Registry()
+bp = Blueprint('metrics', __name__)
+
+
+@contextmanager
+def timer(name):
+    # 统计一段代码的耗时，例如 with timer('password_hash'): ...
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start)
+
+
+def _enabled():
+    return has_request_context() and current_app.config['WATCHLIST_METRICS_ENABLED'] and 'metrics_start' in g
+
+
+@bp.before_app_request
+def start_request():
+    if not current_app.config['WATCHLIST_METRICS_ENABLED']:
+        return
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql = []    # (语句, 耗时)
+    g.metrics_render = 0.0
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _enabled():
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if _enabled() and starts:
+        g.metrics_sql.append((statement, time.perf_counter() - starts.pop()))
+
+
+@before_render_template.connect
+def before_render(sender, template, context, **extra):
+    if _enabled():
+        g.metrics_render_start = time.perf_counter()
+
+
+@template_rendered.connect
+def after_render(sender, template, context, **extra):
+    if _enabled() and 'metrics_render_start' in g:
+        g.metrics_render += time.perf_counter() - g.pop('metrics_render_start')
+
+
+@bp.after_app_request
+def finish_request(response):
+    if not _enabled():
+        return response
+    seconds = time.perf_counter() - g.metrics_start
+    sql_seconds = sum(duration for _, duration in g.metrics_sql)
+    endpoint = request.endpoint or 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    registry.record_request(endpoint, response.status_code, seconds,
+                            len(g.metrics_sql), sql_seconds, g.metrics_render, size)
+
+    # 慢请求日志，带上执行过的 SQL
+    threshold = current_app.config['WATCHLIST_SLOW_REQUEST_MS']
+    if threshold and seconds * 1000 >= threshold:
+        current_app.logger.warning(
+            'Slow request %s %s: %.1fms, %d queries (%.1fms), render %.1fms\n%s',
+            request.method, request.full_path, seconds * 1000, len(g.metrics_sql),
+            sql_seconds * 1000, g.metrics_render * 1000,
+            '\n'.join('  %.2fms %s' % (duration * 1000, statement) for statement, duration in g.metrics_sql))
+    return response
+
+
+@bp.route('/metrics')
+def metrics():
+    if not current_app.config['WATCHLIST_METRICS_ENABLED']:
+        abort(404)
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -1,4 +1,11 @@
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from urllib.parse import quote
+
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
 from flask_login import UserMixin
 from watchlist import db
 
@@ -6,18 +13,224 @@ from watchlist import db
 class User(db.Model, UserMixin):   # 表名将会是 user（自动生成，小写处理）
     id = db.Column(db.Integer, primary_key=True)    # 主键
     name = db.Column(db.String(20))     # 名字
-    username = db.Column(db.String(20))     # 用户名
+    username = db.Column(db.String(20), unique=True, index=True)     # 用户名（唯一索引，登录时按用户名查找）
     password_hash = db.Column(db.String(128))   # 密码散列值
+    movies = db.relationship('Movie', backref='user', lazy='dynamic')
 
     def set_password(self, password):   # 用来设置密码的方法， 接受密码作为参数
-        self.password_hash = generate_password_hash(password)   # 将生成的密码保持到对应字段
+        # 使用配置的散列方法和参数，将生成的密码保持到对应字段
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config['WATCHLIST_PASSWORD_METHOD'],
+            salt_length=current_app.config['WATCHLIST_PASSWORD_SALT_LENGTH'])
 
     def validate_password(self, password):  # 用来验证密码的方法，接受密码作为参数
+        if not self.password_hash:
+            return False
         return check_password_hash(self.password_hash, password)    # 返回布尔值
 
+    def needs_rehash(self):
+        # 散列值前缀记录了生成时的方法和参数，例如 scrypt:32768:8:1$salt$hash
+        method = self.password_hash.split('$', 1)[0] if self.password_hash else ''
+        return method != password_method_prefix(current_app.config['WATCHLIST_PASSWORD_METHOD'])
+
+
+@lru_cache(maxsize=8)
+def password_method_prefix(method):
+    # 配置的方法可以省略参数（例如 scrypt、pbkdf2:sha256），werkzeug 会补上默认参数；
+    # 用它实际生成的散列值前缀比较，每种配置只计算一次
+    return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+
 
 class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(60))    # 电影标题
-    year = db.Column(db.String(10))  # 电影年份
+    year = db.Column(db.Integer)  # 电影年份
     is_read = db.Column(db.Boolean, default=False)     # 是否阅览过
+    # 所属用户；SQLite 的索引包含 rowid，按 id 分页时也能使用这个索引
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    title_key = db.Column(db.String(60))    # 规范化的标题，用于查找重复，见 normalize_title()
+    # 以下三列由触发器维护（见 changes.py），包括批量修改和命令行导入
+    created_at = db.Column(db.DateTime)   # 添加时间（UTC）
+    updated_at = db.Column(db.DateTime)   # 最后修改时间（UTC）
+    seq = db.Column(db.Integer)     # 最后一次修改的变更序号，全局单调递增
+    details = db.Column(db.Text)   # 后台任务从外部获取的资料（JSON），见 enrich.py；{} 表示没有找到
+    # 资料中的条目链接单独保存，渲染列表时不需要解析 details
+    link_site = db.Column(db.String(20))
+    link_url = db.Column(db.String(255))
+
+    @db.validates('title')
+    def update_title_key(self, key, title):
+        self.title_key = normalize_title(title) if title is not None else None
+        return title
+
+    def to_dict(self):
+        return dict(id=self.id, title=self.title, year=self.year, is_read=bool(self.is_read))
+
+    @property
+    def info(self):
+        return json.loads(self.details) if self.details else {}
+
+    def set_details(self, info):
+        self.details = json.dumps(info or {}, ensure_ascii=False)
+        url = (info or {}).get('url')
+        self.link_site, self.link_url = ((info.get('site') or 'imdb')[:20], url[:255]) if url else (None, None)
+
+    @property
+    def external_link(self):     # (站点, 链接)，已获取资料时直接链接到条目，否则中日韩标题搜索豆瓣，其他搜索 IMDb
+        if self.link_url:
+            return self.link_site, self.link_url
+        return external_link(self.title or '')
+
+
+def normalize_title(title):
+    # 去掉变音符号、大小写、空白和标点后的标题，例如 "Léon" 和 "leon" 的结果相同；
+    # NFKD 同时把全角字母数字转换为半角
+    text = unicodedata.normalize('NFKD', title)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    return ''.join(c for c in text if c.isalnum())[:60] or text.strip()[:60]
+
+
+# 中日韩文字：部首、假名、汉字（含扩展 A-G 区和兼容汉字）、谚文
+CJK_RE = re.compile('[\u2e80-\u2fdf\u3040-\u30ff\u31f0-\u31ff\u3400-\u4dbf\u4e00-\u9fff'
+                    '\u1100-\u11ff\u3130-\u318f\uac00-\ud7af\uf900-\ufaff\U00020000-\U0003134f]')
+
+
+def contains_cjk(text):
+    return not text.isascii() and CJK_RE.search(text) is not None    # 纯 ASCII 标题直接跳过正则
+
+
+@lru_cache(maxsize=4096)
+def external_link(title):
+    # 按标题缓存，渲染列表时不再逐个字符判断
+    if contains_cjk(title):
+        return 'douban', 'https://movie.douban.com/subject_search?search_text=' + quote(title, safe='')
+    return 'imdb', 'https://www.imdb.com/find?q=' + quote(title, safe='')
+
+
+# 所有查询都限定在一个用户的清单内，复合索引都以 user_id 开头，
+# 查询代价只和该用户的数据量有关。首页的每种筛选和排序组合（见 facets.SORTS）
+# 都对应一个索引，按索引顺序范围扫描，不需要临时排序
+# 按标题排序、查找（以及导入时按标题 + 年份去重）
+db.Index('ix_movie_user_title_year', Movie.user_id, Movie.title, Movie.year)
+# 查找重复的标题
+db.Index('ix_movie_user_title_key_year', Movie.user_id, Movie.title_key, Movie.year)
+db.Index('ix_movie_user_is_read_title_year', Movie.user_id, Movie.is_read, Movie.title, Movie.year)
+# 按年份排序、筛选年份范围
+db.Index('ix_movie_user_year_id', Movie.user_id, Movie.year, Movie.id)
+db.Index('ix_movie_user_is_read_year_id', Movie.user_id, Movie.is_read, Movie.year, Movie.id)
+# 按添加顺序只看已阅或未阅
+db.Index('ix_movie_user_is_read_id', Movie.user_id, Movie.is_read, Movie.id)
+# 增量同步：按变更序号读取某个用户在某次同步之后修改过的电影
+db.Index('ix_movie_user_seq', Movie.user_id, Movie.seq)
+
+
+# SQLite（以及 BIGINT 列）能保存的整数范围，超出时绑定参数会抛出 OverflowError
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def is_int64(value):
+    return isinstance(value, int) and not isinstance(value, bool) and INT64_MIN <= value <= INT64_MAX
+
+
+def to_bool(value):
+    # 与 distutils.util.strtobool 的规则相同，缺省值视为 False
+    if isinstance(value, bool):
+        return value
+    value = str(value if value is not None else '').strip().lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    if value in ('n', 'no', 'f', 'false', 'off', '0', ''):
+        return False
+    raise ValueError('invalid truth value %r' % value)
+
+
+def validate_movie(data):
+    # 表单、API 和批量导入共用的校验规则，无效时返回 None
+    if not isinstance(data, dict):
+        return None
+    title = data.get('title')
+    year = data.get('year')
+    title = title.strip() if isinstance(title, str) else ''
+    year = str(year).strip() if isinstance(year, (str, int)) and not isinstance(year, bool) else ''
+    try:
+        is_read = to_bool(data.get('is_read'))
+    except ValueError:
+        return None
+    # isdigit() 也接受 '²' 等非 ASCII 数字，int() 无法转换
+    if not title or not (year.isascii() and year.isdigit()) or len(year) > 4 or len(title) > 60:
+        return None
+    return dict(title=title, year=int(year), is_read=is_read)
+
+
+BULK_ACTIONS = ('read', 'unread', 'delete')
+BULK_CHUNK_SIZE = 500    # 每条语句的 id 个数，低于 SQLite 的参数个数上限
+
+
+def parse_ids(values):
+    # 批量操作的 id 列表，去重排序；包含无效的 id 时返回 None
+    try:
+        ids = {int(value) for value in values}
+    except (TypeError, ValueError):
+        return None
+    if not all(is_int64(i) for i in ids):    # 超出范围的 id 绑定参数时会溢出
+        return None
+    return sorted(ids)
+
+
+def bulk_update(user_id, ids, action):
+    # 对 user_id 清单中的多部电影执行同一操作，返回受影响的行数；
+    # 用 UPDATE/DELETE ... WHERE id IN (...) 完成，不加载记录，由调用者一次提交
+    count = 0
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        condition = (Movie.user_id == user_id, Movie.id.in_(ids[start:start + BULK_CHUNK_SIZE]))
+        if action == 'delete':
+            statement = db.delete(Movie).where(*condition)
+        else:
+            statement = db.update(Movie).where(*condition).values(is_read=action == 'read')
+        count += db.session.execute(statement, execution_options=dict(synchronize_session=False)).rowcount
+    return count
+
+
+class Tombstone(db.Model):    # 已删除电影的记录，供客户端增量同步，由触发器写入
+    seq = db.Column(db.Integer, primary_key=True)   # 删除时的变更序号
+    movie_id = db.Column(db.Integer, nullable=False)
+    # SQLite 的索引包含 rowid（即 seq），按用户和序号范围查找只需要这个索引
+    user_id = db.Column(db.Integer, index=True)
+    deleted_at = db.Column(db.DateTime)
+
+
+class Job(db.Model):    # 后台任务，状态保存在数据库中，进程重启后不会丢失，见 jobs.py
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)    # 任务类型，对应 tasks.py 中的处理函数
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)    # 提交任务的用户，命令行提交的为空
+    params = db.Column(db.Text)    # 参数（JSON）
+    # queued -> running -> done / failed / cancelled；失败后还能重试时回到 queued
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)    # 已处理的数量
+    total = db.Column(db.Integer)    # 总数，未知时为空
+    result = db.Column(db.Text)    # 完成后的结果（JSON）
+    error = db.Column(db.Text)    # 最后一次失败的原因
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    run_after = db.Column(db.DateTime)    # 重试时在这个时间之后才执行
+    created_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)    # 执行中定期更新，长时间没有更新说明执行的进程已经退出
+
+    def to_dict(self):
+        return dict(id=self.id, kind=self.kind, status=self.status, progress=self.progress, total=self.total,
+                    attempts=self.attempts, max_attempts=self.max_attempts,
+                    cancel_requested=bool(self.cancel_requested),
+                    result=json.loads(self.result) if self.result else None, error=self.error)
+
+
+# 取下一个待执行的任务：按状态范围扫描，按 id 先进先出
+db.Index('ix_job_status_id', Job.status, Job.id)
+
+
+class Counter(db.Model):   # 通用计数器表，按名字保存一个整数
+    name = db.Column(db.String(30), primary_key=True)
+    # 版本号从毫秒时间戳开始（见 cache.bump_version），超出 PostgreSQL/MySQL 的 32 位 INTEGER
+    value = db.Column(db.BigInteger, nullable=False, default=0)
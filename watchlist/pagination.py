@@ -0,0 +1,108 @@
+import base64
+import json
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+from watchlist.models import is_int64
+
+
+class KeysetPage:
+    # 基于游标（keyset）的分页结果，只保存当前页的数据
+
+    def __init__(self, items, limit, has_next, has_prev, columns=('id',)):
+        self.items = items
+        self.limit = limit
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.columns = columns    # 排序列的属性名，游标由这些列的值组成
+
+    def cursor(self, item):
+        if len(self.columns) == 1:
+            return getattr(item, self.columns[0])
+        return encode_cursor([getattr(item, name) for name in self.columns])
+
+    @property
+    def next_after(self):   # 下一页的游标：当前页最后一条记录
+        if self.has_next and self.items:
+            return self.cursor(self.items[-1])
+        return None
+
+    @property
+    def prev_before(self):  # 上一页的游标：当前页第一条记录
+        if self.has_prev and self.items:
+            return self.cursor(self.items[0])
+        return None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    # 多列游标：JSON 数组的 URL 安全 base64 编码
+    data = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+    # 解析 URL 中的游标，单列时是整数 id；无效时抛出 ValueError
+    if token is None or token == '':
+        return None
+    try:
+        if len(columns) == 1:
+            values = [int(token)]
+        else:
+            values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, ValueError) as e:    # binascii.Error 和 UnicodeDecodeError 都是 ValueError
+        raise ValueError('Invalid cursor.') from e
+    if not isinstance(values, list) or len(values) != len(columns) \
+            or any(isinstance(value, int) and not is_int64(value) for value in values):
+        raise ValueError('Invalid cursor.')
+    return values[0] if len(columns) == 1 else values
+
+
+def get_limit(value):
+    # 每页条数，限制在 1 ~ WATCHLIST_MAX_PER_PAGE 之间
+    default = current_app.config['WATCHLIST_PER_PAGE']
+    maximum = current_app.config['WATCHLIST_MAX_PER_PAGE']
+    if value is None or value < 1:
+        return default
+    return min(value, maximum)
+
+
+def keyset_condition(columns, cursor, descending=False, reverse=False):
+    # 排在游标之后（reverse 时为之前）的记录，多列时使用行值比较 (a, b) > (?, ?)，
+    # 可以利用以这些列开头的索引做范围扫描
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    value = tuple_(*cursor) if len(columns) > 1 else cursor
+    return key < value if descending != reverse else key > value
+
+
+def keyset_order(columns, descending=False):
+    return [column.desc() if descending else column.asc() for column in columns]
+
+
+def keyset_paginate(query, column, after=None, before=None, limit=None, descending=False):
+    # 按 column 稳定排序，用 WHERE column > after 代替 OFFSET，
+    # 多取一条用来判断是否还有下一页，避免额外的 COUNT 查询；
+    # column 也可以是多列的元组，最后一列必须唯一（通常是主键），游标为对应的值列表
+    limit = get_limit(limit)
+    columns = tuple(column) if isinstance(column, (tuple, list)) else (column,)
+    names = tuple(c.key for c in columns)
+
+    if before is not None:
+        rows = query.filter(keyset_condition(columns, before, descending, reverse=True)) \
+            .order_by(*keyset_order(columns, not descending)).limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        items = rows[:limit][::-1]
+        return KeysetPage(items, limit, has_next=True, has_prev=has_prev, columns=names)
+
+    if after is not None:
+        query = query.filter(keyset_condition(columns, after, descending))
+    rows = query.order_by(*keyset_order(columns, descending)).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    return KeysetPage(rows[:limit], limit, has_next=has_next,
+                      has_prev=after is not None, columns=names)
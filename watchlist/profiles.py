@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, g
+from flask_login import UserMixin, current_user
+
+from watchlist import db
+from watchlist.models import User
+
+
+class UserProfile(UserMixin):
+    # 用户资料的只读快照，不绑定数据库会话，可以跨请求缓存；
+    # 需要修改用户时用 id 重新查询 User。version 是加载时这个用户清单的版本号，
+    # 改名时会更新版本号，页面缓存用它判断资料是否已经过期（见 cache.cached_page）
+
+    def __init__(self, id, name, username, version=None):
+        self.id = id
+        self.name = name
+        self.username = username
+        self.version = version
+
+    @classmethod
+    def from_user(cls, user):
+        from watchlist.cache import get_version    # cache 模块导入了本模块
+        # 和用户记录在同一个读事务中读取，版本号和资料一致
+        return cls(user.id, user.name, user.username, get_version(user.id))
+
+
+class ProfileCache:
+    # 进程级 LRU 缓存，条目在 ttl 秒后过期，最多保存 maxsize 个用户；
+    # 本进程内的修改调用 invalidate() 立即失效，
+    # 其他进程（例如 flask admin 命令）的修改最多 ttl 秒后生效
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                return entry[0]
+        profile = loader()
+        if profile is not None:    # 不缓存不存在的用户，创建后马上可见
+            with self._lock:
+                self._data.pop(key, None)
+                self._data[key] = (profile, now + current_app.config['WATCHLIST_PROFILE_TTL'])
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return profile
+
+    def __len__(self):
+        return len(self._data)
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[0] if entry is not None else None
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+
+
+profile_cache = ProfileCache()    # 大小在 create_app() 中按 WATCHLIST_PROFILE_CACHE_SIZE 设置
+
+
+def _load_owner():
+    user = User.query.order_by(User.id).first()
+    return UserProfile.from_user(user) if user is not None else None
+
+
+def _load_user(user_id):
+    user = db.session.get(User, user_id)
+    return UserProfile.from_user(user) if user is not None else None
+
+
+def get_owner():
+    # 清单主人的资料，同一个请求内只解析一次
+    if 'owner' not in g:
+        g.owner = profile_cache.get('owner', _load_owner)
+    return g.owner
+
+
+def get_list_owner():
+    # 当前页面展示谁的清单：登录用户看自己的，访客看清单主人的
+    if current_user.is_authenticated:
+        return current_user
+    return get_owner()
+
+
+def get_profile(user_id):
+    return profile_cache.get(user_id, lambda: _load_user(user_id))
+
+
+def invalidate_profiles():
+    profile_cache.invalidate()
+    g.pop('owner', None)
+
+
+def discard_profile(profile):
+    # 丢弃一个用户缓存的资料（包括作为清单主人缓存的），下次使用时重新加载
+    profile_cache.discard(profile.id)
+    if getattr(profile_cache.peek('owner'), 'id', None) == profile.id:
+        profile_cache.discard('owner')
+    if getattr(g.get('owner'), 'id', None) == profile.id:
+        g.pop('owner')
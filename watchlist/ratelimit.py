@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TokenBucket:
+    # 进程内的令牌桶限流：每个键最多积累 burst 个令牌，每秒补充 rate 个，
+    # 每次操作消耗一个；多进程部署时每个 worker 各自限流。
+    # 令牌是满的桶和没有记录的键等价，不保存，已经补满的桶也会被清除，
+    # 大量不同的用户名只占用和近期成功尝试数量相当的内存
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize    # 最多记录的键数，超过时丢弃最久未使用的
+        self._buckets = OrderedDict()    # 键 -> (令牌数, 上次补充的时间)
+        self._lock = Lock()
+
+    def _refill(self, key, rate, burst, now):
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        return min(burst, tokens + (now - updated) * rate)
+
+    def acquire(self, keys, rate, burst):
+        # 所有键都有令牌时各消耗一个并返回 0，否则不消耗，返回需要等待的秒数
+        now = time.monotonic()
+        with self._lock:
+            tokens = {key: self._refill(key, rate, burst, now) for key in keys}
+            wait = max((1 - value) / rate for value in tokens.values())
+            allowed = wait <= 0
+            for key, value in tokens.items():
+                value = value - 1 if allowed else value
+                if value < burst:
+                    self._buckets[key] = (value, now)
+            # 从最久未使用的一端清除已经补满的桶
+            while self._buckets:
+                key, (value, updated) = next(iter(self._buckets.items()))
+                if value + (now - updated) * rate < burst and len(self._buckets) <= self.maxsize:
+                    break
+                del self._buckets[key]
+        return 0 if allowed else wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+login_limiter = TokenBucket()
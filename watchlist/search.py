@@ -0,0 +1,104 @@
+from watchlist import db
+from watchlist.models import Movie
+from watchlist.engine import is_sqlite, attach_to_table
+
+# 外部内容（external content）的 FTS5 表，只保存 movie.title 的索引，
+# trigram 分词器按三个字符切分，中文标题不需要额外的分词
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5("
+    "title, content='movie', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS movie_fts_ai AFTER INSERT ON movie BEGIN "
+    "INSERT INTO movie_fts (rowid, title) VALUES (new.id, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS movie_fts_ad AFTER DELETE ON movie BEGIN "
+    "INSERT INTO movie_fts (movie_fts, rowid, title) VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS movie_fts_au AFTER UPDATE OF title ON movie BEGIN "
+    "INSERT INTO movie_fts (movie_fts, rowid, title) VALUES ('delete', old.id, old.title); "
+    "INSERT INTO movie_fts (rowid, title) VALUES (new.id, new.title); END",
+]
+
+MIN_TERM_LENGTH = 3    # trigram 无法匹配少于三个字符的词
+LIKE_MAX_MATCHES = 1000    # 只有短词时最多取这么多匹配的电影排序，之后的结果不再显示
+
+
+def create_search_index(connection):
+    # 创建 FTS5 表和同步触发器，返回是否是新建的
+    if not is_sqlite(connection):
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'movie_fts'").first()
+    for statement in SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    return exists is None
+
+
+def drop_search_index(connection):
+    if is_sqlite(connection):
+        connection.exec_driver_sql('DROP TABLE IF EXISTS movie_fts')
+
+
+attach_to_table(Movie.__table__, create_search_index, drop_search_index)
+
+
+def rebuild_search_index(batch_size=10000):
+    # 清空索引后按 id 分批重新写入，每批提交一次，生成器返回已索引的行数
+    db.session.execute(db.text("INSERT INTO movie_fts (movie_fts) VALUES ('delete-all')"))
+    db.session.commit()
+    last_id, indexed = 0, 0
+    while True:
+        # movie_fts 是外部内容表，max(rowid) 读到的是 movie 表的最大 id，
+        # 所以先取出这一批的最后一个 id，再写入这个范围
+        end = db.session.execute(db.text(
+            'SELECT max(id) FROM (SELECT id FROM movie WHERE id > :last_id ORDER BY id LIMIT :size)'),
+            dict(last_id=last_id, size=batch_size)).scalar()
+        if end is None:
+            break
+        result = db.session.execute(db.text(
+            'INSERT INTO movie_fts (rowid, title) SELECT id, title FROM movie WHERE id > :last_id AND id <= :end'),
+            dict(last_id=last_id, end=end))
+        indexed += result.rowcount
+        last_id = end
+        db.session.commit()
+        yield indexed
+
+
+def _like(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def search_movies(q, user_id, page=1, limit=20):
+    # 在 user_id 的清单中搜索，返回 (当前页的电影, 是否有下一页)，结果按相关度排序
+    terms = q.split()
+    long_terms = [t for t in terms if len(t) >= MIN_TERM_LENGTH]
+    short_terms = [t for t in terms if len(t) < MIN_TERM_LENGTH]
+    params = dict(user_id=user_id, limit=limit + 1, offset=(page - 1) * limit)
+
+    # 短词用 LIKE 在候选集上过滤
+    conditions = ['movie.user_id = :user_id']
+    for i, term in enumerate(short_terms):
+        conditions.append("movie.title LIKE :t%d ESCAPE '\\'" % i)
+        params['t%d' % i] = _like(term)
+
+    if long_terms and is_sqlite(db.session.connection()):
+        # 每个词作为短语加引号，避免用户输入被解释成 FTS5 语法
+        params['match'] = ' '.join('"%s"' % t.replace('"', '""') for t in long_terms)
+        conditions.insert(0, 'movie_fts MATCH :match')
+        # CROSS JOIN 固定由全文索引驱动查询，否则 SQLite 可能按 user_id 索引遍历这个用户的
+        # 所有电影，再逐条检查 MATCH
+        sql = ('SELECT movie.id FROM movie_fts CROSS JOIN movie ON movie.id = movie_fts.rowid '
+               'WHERE %s ORDER BY movie_fts.rank LIMIT :limit OFFSET :offset')
+    else:
+        # 只有短词（例如两个字的中文标题）时退回到 LIKE，标题越短越靠前。
+        # 在 (user_id, title) 索引上逐条匹配，找到 LIKE_MAX_MATCHES 个就停止扫描，
+        # 常见的单字不会遍历整个清单再排序
+        for i, term in enumerate(long_terms, len(short_terms)):
+            conditions.append("movie.title LIKE :t%d ESCAPE '\\'" % i)
+            params['t%d' % i] = _like(term)
+        params['max_matches'] = LIKE_MAX_MATCHES
+        sql = ('SELECT id FROM (SELECT movie.id, movie.title FROM movie WHERE %s LIMIT :max_matches) '
+               'ORDER BY length(title), id LIMIT :limit OFFSET :offset')
+
+    ids = [row[0] for row in db.session.execute(db.text(sql % ' AND '.join(conditions)), params)]
+    has_next = len(ids) > limit
+    ids = ids[:limit]
+    movies = {m.id: m for m in Movie.query.filter(Movie.id.in_(ids))} if ids else {}
+    return [movies[i] for i in ids if i in movies], has_next
@@ -0,0 +1,112 @@
+from watchlist import db
+from watchlist.cache import PageCache, get_version
+from watchlist.models import Movie
+from watchlist.engine import is_sqlite, attach_to_table
+
+# 按 (用户, 年份, 是否已阅) 汇总的电影数量，由触发器在 movie 表变化时增量维护，
+# 包括批量导入、executemany 和批量 UPDATE/DELETE；读取统计不需要扫描 movie 表。
+# 没有年份或所属用户的电影记为 0
+STATS_DDL = [
+    "CREATE TABLE IF NOT EXISTS movie_stats ("
+    "user_id INTEGER NOT NULL, year INTEGER NOT NULL, is_read INTEGER NOT NULL, "
+    "count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (user_id, year, is_read)) WITHOUT ROWID",
+    "CREATE TRIGGER IF NOT EXISTS movie_stats_ai AFTER INSERT ON movie BEGIN "
+    "INSERT INTO movie_stats (user_id, year, is_read, count) "
+    "VALUES (ifnull(new.user_id, 0), ifnull(new.year, 0), ifnull(new.is_read, 0), 1) "
+    "ON CONFLICT (user_id, year, is_read) DO UPDATE SET count = count + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS movie_stats_ad AFTER DELETE ON movie BEGIN "
+    "UPDATE movie_stats SET count = count - 1 WHERE user_id = ifnull(old.user_id, 0) "
+    "AND year = ifnull(old.year, 0) AND is_read = ifnull(old.is_read, 0); END",
+    "CREATE TRIGGER IF NOT EXISTS movie_stats_au AFTER UPDATE OF user_id, year, is_read ON movie BEGIN "
+    "UPDATE movie_stats SET count = count - 1 WHERE user_id = ifnull(old.user_id, 0) "
+    "AND year = ifnull(old.year, 0) AND is_read = ifnull(old.is_read, 0); "
+    "INSERT INTO movie_stats (user_id, year, is_read, count) "
+    "VALUES (ifnull(new.user_id, 0), ifnull(new.year, 0), ifnull(new.is_read, 0), 1) "
+    "ON CONFLICT (user_id, year, is_read) DO UPDATE SET count = count + 1; END",
+]
+
+REBUILD_SQL = [
+    'DELETE FROM movie_stats',
+    'INSERT INTO movie_stats (user_id, year, is_read, count) '
+    'SELECT ifnull(user_id, 0), ifnull(year, 0), ifnull(is_read, 0), count(*) FROM movie GROUP BY 1, 2, 3',
+]
+
+
+def create_stats_table(connection):
+    # 创建汇总表和触发器，返回是否是新建的
+    if not is_sqlite(connection):
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'movie_stats'").first()
+    for statement in STATS_DDL:
+        connection.exec_driver_sql(statement)
+    return exists is None
+
+
+def drop_stats_table(connection):
+    if is_sqlite(connection):
+        connection.exec_driver_sql('DROP TABLE IF EXISTS movie_stats')
+
+
+attach_to_table(Movie.__table__, create_stats_table, drop_stats_table)
+
+
+def rebuild_stats():
+    # 用 GROUP BY 重新计算汇总表，用于修复或回填，返回汇总的行数
+    for statement in REBUILD_SQL:
+        result = db.session.execute(db.text(statement))
+    return result.rowcount
+
+
+# 按清单版本号缓存每个用户的统计行，清单变化后版本号改变，旧条目不会再被读取
+stats_cache = PageCache()
+
+
+def stats_rows(user_id):
+    # user_id 清单的 [(年份, 是否已阅, 数量)]
+    key = (user_id, get_version(user_id))
+    rows = stats_cache.get(key)
+    if rows is None:
+        rows = _load_stats_rows(user_id)
+        stats_cache.set(key, rows)
+    return rows
+
+
+def _load_stats_rows(user_id):
+    # 只读取汇总表中这个用户的行（每个年份最多两行）
+    if is_sqlite(db.session.connection()):
+        rows = db.session.execute(db.text(
+            'SELECT year, is_read, count FROM movie_stats WHERE user_id = :user_id AND count > 0'),
+            dict(user_id=user_id or 0))
+    else:
+        # 其他数据库没有触发器，直接分组统计
+        rows = db.session.execute(
+            db.select(Movie.year, Movie.is_read, db.func.count()).where(Movie.user_id == user_id)
+            .group_by(Movie.year, Movie.is_read))
+    return [(year or None, bool(is_read), count) for year, is_read, count in rows]
+
+
+def get_stats(user_id):
+    return summarize(stats_rows(user_id))
+
+
+def summarize(rows):
+    # 由统计行计算总数、已阅/未阅数量，以及按年份和年代的分布
+    years, decades = {}, {}
+    total = read = 0
+    for year, is_read, count in rows:
+        status = 'read' if is_read else 'unread'
+        total += count
+        read += count if is_read else 0
+        for key, groups in ((year, years), (year - year % 10 if year else None, decades)):
+            group = groups.setdefault(key, dict(read=0, unread=0, total=0))
+            group[status] += count
+            group['total'] += count
+
+    def listing(groups, name):
+        # 按年份从新到旧，没有年份的放在最后
+        keys = sorted(groups, key=lambda key: (key is None, -(key or 0)))
+        return [dict({name: key}, **groups[key]) for key in keys]
+
+    return dict(total=total, read=read, unread=total - read,
+                years=listing(years, 'year'), decades=listing(decades, 'decade'))
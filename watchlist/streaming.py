@@ -0,0 +1,29 @@
+from flask import current_app, stream_template
+
+from watchlist import db
+
+
+def iter_rows(statement, batch_size=None):
+    # 用服务器端游标逐批读取 ORM 对象，处理过的对象不会留在内存里
+    batch_size = batch_size or current_app.config['WATCHLIST_STREAM_BATCH_SIZE']
+    return db.session.execute(statement.execution_options(yield_per=batch_size)).scalars()
+
+
+def chunked(parts, chunk_size):
+    # 把模板生成的小片段合并成 chunk_size 左右的块再发送
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    # 边渲染边发送，首字节时间和内存占用都不随列表长度增长
+    parts = stream_template(template_name, **context)
+    return current_app.response_class(
+        chunked(parts, current_app.config['WATCHLIST_STREAM_CHUNK_SIZE']), mimetype='text/html')
@@ -0,0 +1,74 @@
+from watchlist import db
+from watchlist.models import Movie
+from watchlist.cache import bump_version
+from watchlist.jobs import handler
+from watchlist.transfer import guess_format, read_rows, import_movies, iter_movies, write_rows
+from watchlist.stats import rebuild_stats
+from watchlist.enrich import get_provider
+
+# 后台任务的处理函数。任务可能被重试，处理函数要能安全地重复执行：
+# 导入按标题和年份去重，导出覆盖文件，获取资料跳过已有资料的电影
+
+
+@handler('import')
+def import_file(context, path, user_id, fmt=None, batch_size=5000):
+    with open(path, encoding='utf-8') as f:
+        read = inserted = invalid = 0
+        for read, inserted, invalid in import_movies(read_rows(f, fmt or guess_format(path)), user_id, batch_size):
+            bump_version(user_id)
+            context.progress(read)
+    return dict(read=read, inserted=inserted, invalid=invalid)
+
+
+@handler('export')
+def export_file(context, path, user_id, fmt=None, batch_size=5000):
+    total = db.session.execute(db.select(db.func.count()).where(Movie.user_id == user_id)).scalar()
+
+    def rows():
+        for count, row in enumerate(iter_movies(user_id, batch_size), 1):
+            yield row
+            if count % batch_size == 0:
+                context.progress(count, total)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        count = write_rows(f, rows(), fmt or guess_format(path))
+    return dict(exported=count)
+
+
+@handler('rebuild-stats')
+def rebuild_stats_task(context):
+    groups = rebuild_stats()
+    bump_version()
+    db.session.commit()
+    return dict(groups=groups)
+
+
+@handler('enrich')
+def enrich(context, user_id, ids=None, force=False, batch_size=50):
+    # 为 user_id 清单中的电影获取资料，按 id 分批，每批提交一次；
+    # ids 为空时处理所有还没有资料的电影，force 时重新获取
+    provider = get_provider()
+    if provider is None:
+        raise RuntimeError('No enrichment provider is configured.')
+    query = db.select(Movie).where(Movie.user_id == user_id)
+    if ids:
+        query = query.where(Movie.id.in_(ids))
+    if not force:
+        query = query.where(Movie.details.is_(None))
+    total = db.session.execute(query.with_only_columns(db.func.count())).scalar()
+
+    last_id = done = found = 0
+    while True:
+        movies = db.session.execute(
+            query.where(Movie.id > last_id).order_by(Movie.id).limit(batch_size)).scalars().all()
+        if not movies:
+            break
+        for movie in movies:
+            info = provider.lookup(movie.title, movie.year)
+            movie.set_details(info)
+            found += 1 if info else 0
+        last_id = movies[-1].id
+        done += len(movies)
+        bump_version(user_id)    # 列表中的链接改变了
+        context.progress(done, total)
+    return dict(enriched=done, found=found)
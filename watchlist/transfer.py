@@ -0,0 +1,99 @@
+import csv
+import json
+from itertools import islice
+
+from watchlist import db
+from watchlist.models import validate_movie, normalize_title
+
+FIELDS = ['title', 'year', 'is_read']
+
+# 同一用户的清单中同名同年份的电影已存在时跳过，文件内部的重复行也会被跳过
+INSERT_SQL = db.text(
+    'INSERT INTO movie (user_id, title, title_key, year, is_read) '
+    'SELECT :user_id, :title, :title_key, :year, :is_read '
+    'WHERE NOT EXISTS (SELECT 1 FROM movie WHERE user_id = :user_id AND title = :title AND year = :year)')
+
+SELECT_SQL = db.text(
+    'SELECT id, title, year, is_read FROM movie '
+    'WHERE user_id = :user_id AND id > :last_id ORDER BY id LIMIT :size')
+
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'json'}
+
+
+def guess_format(filename):
+    # .json 是一个 JSON 数组，.jsonl 每行一个对象，其他按 CSV 处理
+    return next((fmt for ext, fmt in FORMATS.items() if filename.endswith(ext)), 'csv')
+
+
+def read_rows(fp, fmt):
+    # 逐行读取文件的生成器，不会把整个文件读进内存（JSON 数组只能整个读取）。
+    # 无法解析的行返回 None，由 validate_movie 计为无效行
+    if fmt == 'csv':
+        yield from csv.DictReader(fp)
+    elif fmt == 'json':
+        rows = json.load(fp)
+        if not isinstance(rows, list):
+            raise ValueError('Expected a JSON array of movies.')
+        yield from rows
+    else:
+        for line in fp:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def import_movies(rows, user_id, batch_size=5000):
+    # 导入到 user_id 的清单，分批 executemany 插入，每批提交一次；
+    # 生成器每批返回 (已读取行数, 已插入行数, 无效行数)，重复的行 = 读取 - 插入 - 无效
+    read = inserted = invalid = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        read += len(chunk)
+        batch = [dict(row, user_id=user_id, title_key=normalize_title(row['title']))
+                 for row in map(validate_movie, chunk) if row is not None]
+        invalid += len(chunk) - len(batch)
+        if batch:
+            inserted += db.session.execute(INSERT_SQL, batch).rowcount
+            db.session.commit()
+        yield read, inserted, invalid
+
+
+def iter_movies(user_id, batch_size=5000):
+    # 按 id 分批读取 user_id 清单中的电影，只持有一批数据
+    last_id = 0
+    while True:
+        rows = db.session.execute(SELECT_SQL, dict(user_id=user_id, last_id=last_id, size=batch_size)).all()
+        if not rows:
+            break
+        for row in rows:
+            yield dict(title=row.title, year=row.year, is_read=bool(row.is_read))
+        last_id = rows[-1].id
+
+
+def write_rows(fp, rows, fmt):
+    # 逐行写出，返回写出的行数
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(fp, fieldnames=FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    elif fmt == 'json':
+        # 逐个写出数组元素，不在内存中拼出整个数组
+        fp.write('[')
+        for row in rows:
+            fp.write((',\n' if count else '\n') + json.dumps(row, ensure_ascii=False))
+            count += 1
+        fp.write('\n]\n')
+    else:
+        for row in rows:
+            fp.write(json.dumps(row, ensure_ascii=False) + '\n')
+            count += 1
+    return count
@@ -1,93 +1,171 @@
-from flask import render_template, request, url_for, redirect, flash
-from flask_login import login_user, login_required, logout_user, current_user
-from watchlist import app, db
-from watchlist.models import User, Movie
-from distutils.util import strtobool
-
+import math
 
-@app.route('/', methods=['GET', 'POST'])
+from flask import Blueprint, current_app, render_template, request, url_for, redirect, flash, abort
+from flask_login import login_user, login_required, logout_user, current_user
+from watchlist import db
+from watchlist.models import User, Movie, validate_movie, parse_ids, bulk_update, BULK_ACTIONS, is_int64
+from watchlist.cache import cached_page, bump_version, page_cache
+from watchlist.pagination import get_limit
+from watchlist.facets import parse_filters, paginate_movies, sorted_statement, facet_counts, filter_url
+from watchlist.search import search_movies
+from watchlist.dedupe import find_duplicates
+from watchlist.stats import get_stats, stats_rows, summarize
+from watchlist.streaming import stream_page, iter_rows
+from watchlist.profiles import invalidate_profiles, get_list_owner
+from watchlist.ratelimit import login_limiter
+from watchlist.metrics import timer
+
+bp = Blueprint('main', __name__)
+bp.add_app_template_global(filter_url)
+
+
+@bp.app_context_processor
+def inject_user():
+    return dict(user=get_list_owner())
+
+
+@bp.route('/', methods=['GET', 'POST'])
+@cached_page
 def index():
     if request.method == 'POST':
         if not current_user.is_authenticated:    # 如果当前用户未认证
-            return redirect(url_for('index'))
-        # 获取表单数据
-        title = request.form.get('title')   # 传入表单对应输入字段的name值
-        year = request.form.get('year')
-        try:
-            is_read = strtobool(request.values.get('is_read'))
-        except ValueError:
-            flash('Invalid input.')  # 显示错误提示
-            return redirect(url_for('index'))  # 重定向回主页
-        else:
-            pass
-
-        # 验证数据
-        if not title or not year or len(year) > 4 or len(title) > 60:
+            return redirect(url_for('main.index'))
+        # 获取并验证表单数据
+        data = validate_movie(request.form)
+        if data is None:
             flash('Invalid input.')     # 显示错误提示
-            return redirect(url_for('index'))   # 重定向回主页
+            return redirect(url_for('main.index'))   # 重定向回主页
+        duplicates = find_duplicates(current_user.id, data['title'], data['year'])    # 在添加之前查找
         # 保存表单数据到数据库
-        movie = Movie(title=title, year=year, is_read=is_read)    # 创建记录
+        movie = Movie(user_id=current_user.id, **data)    # 创建记录，属于当前用户
         db.session.add(movie)   # 添加到数据库对话
+        bump_version(current_user.id)  # 清单已变化，使缓存的页面失效
         db.session.commit()     # 提交数据库对话
         flash('Item created.')  # 显示成功创建的提示
-        return redirect(url_for('index'))   # 重定向回主页
+        flash_duplicates(duplicates)
+        return redirect(url_for('main.index'))   # 重定向回主页
+
+    # 只查询清单主人的电影，user_id 开头的索引让查询代价只和这个用户的数据量有关
+    owner = get_list_owner()
+    owner_id = owner.id if owner is not None else None
+    try:
+        filters = parse_filters(request.args)
+        if request.args.get('stream', type=int):
+            # 流式模式：不分页，从 after 之后逐批读取并边渲染边发送
+            page = None
+            statement = sorted_statement(db.select(Movie), owner_id, filters, request.args.get('after'))
+        else:
+            # 按排序列的游标分页读取，只加载当前页的记录
+            page = paginate_movies(owner_id, filters, request.args)
+    except ValueError:
+        abort(400)    # 无效的筛选条件或游标
 
-    movies = Movie.query.all()  # 读取所有电影记录
-    return render_template('index.html', movies=movies)
+    # 总数、分面计数等统计从增量维护的汇总表读取，不扫描 movie 表
+    rows = stats_rows(owner_id)
+    context = dict(stats=summarize(rows), facets=facet_counts(rows, filters), filters=filters)
+    if page is None:
+        return stream_page('index.html', movies=iter_rows(statement), page=None, **context)
+    return render_template('index.html', movies=page.items, page=page, **context)
 
 
-@app.route('/movie/edit/<int:movie_id>', methods=['GET', 'POST'])
+def flash_duplicates(movies):
+    # 只提示，不阻止添加：同名的电影也可能是不同的作品
+    if movies:
+        flash('Possible duplicate of %s.' % ', '.join('%s (%s)' % (m.title, m.year) for m in movies))
+
+
+@bp.route('/movie/edit/<int:movie_id>', methods=['GET', 'POST'])
 @login_required    # 登录保护
 def edit(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    movie = Movie.query.filter_by(id=movie_id, user_id=current_user.id).first_or_404()    # 只能修改自己的电影
 
     if request.method == 'POST':
-        title = request.form['title']
-        year = request.form['year']
-        try:
-            is_read = strtobool(request.values['is_read'])
-        except ValueError:
+        data = validate_movie(request.form)
+        if data is None:
             flash('Invalid input.')     # 显示错误提示
-            return redirect(url_for('index'))   # 重定向回对应的编辑页面
-        else:
-            pass
-        if not title or not year or len(year) > 4 or len(title) > 60:
-            flash('Invalid input.')     # 显示错误提示
-            return redirect(url_for('index'))   # 重定向回对应的编辑页面
-        movie.title = title  # 更新标题
-        movie.year = year  # 更新年份
-        movie.is_read = is_read  # 更新阅览情况
+            return redirect(url_for('main.index'))   # 重定向回对应的编辑页面
+        duplicates = find_duplicates(current_user.id, data['title'], data['year'], exclude_id=movie.id)
+        movie.title = data['title']  # 更新标题
+        movie.year = data['year']  # 更新年份
+        movie.is_read = data['is_read']  # 更新阅览情况
+        bump_version(current_user.id)
         db.session.commit()  # 提交数据库会话
         flash('Item updated.')
-        return redirect(url_for('index'))  # 重定向回主页
+        flash_duplicates(duplicates)
+        return redirect(url_for('main.index'))  # 重定向回主页
 
     return render_template('edit.html', movie=movie)  # 传入被编辑的电影记录
 
 
-@app.route('/movie/delete/<int:movie_id>', methods=['POST'])
+@bp.route('/movie/delete/<int:movie_id>', methods=['POST'])
 @login_required    # 登录保护
 def delete(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    movie = Movie.query.filter_by(id=movie_id, user_id=current_user.id).first_or_404()    # 只能修改自己的电影
     db.session.delete(movie)
+    bump_version(current_user.id)
     db.session.commit()
     flash('Item deleted.')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/test')
+# 批量标记已阅/未阅或删除选中的电影，一个事务完成
+@bp.route('/movie/bulk', methods=['POST'])
+@login_required
+def bulk():
+    action = request.form.get('action')
+    ids = parse_ids(request.form.getlist('ids'))
+    if action not in BULK_ACTIONS or not ids:
+        flash('Invalid input.')
+        return redirect(url_for('main.index'))
+    count = bulk_update(current_user.id, ids, action)
+    bump_version(current_user.id)
+    db.session.commit()
+    flash('%d items %s.' % (count, 'deleted' if action == 'delete' else 'updated'))
+    return redirect(url_for('main.index'))
+
+
+# 搜索标题
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    movies, has_next = [], False
+    owner = get_list_owner()
+    limit = get_limit(request.args.get('limit', type=int))
+    if not is_int64(page * limit):
+        abort(400)    # OFFSET 超出 SQLite 的整数范围
+    if q and owner is not None:
+        movies, has_next = search_movies(q, owner.id, page=page, limit=limit)
+    return render_template('search.html', q=q, movies=movies, page=page, has_next=has_next)
+
+
+# 清单统计：已阅/未阅总数，按年份和年代的分布
+@bp.route('/stats')
+def stats():
+    owner = get_list_owner()
+    return get_stats(owner.id if owner is not None else None)
+
+
+# 页面缓存命中情况
+@bp.route('/cache/stats')
+def cache_stats():
+    return page_cache.stats()
+
+
+@bp.route('/test')
 def test_url_for():
     # 下面是一些调用示例
-    print(url_for('user_page', name='greyli'))  # 输出：/user/greyli
-    print(url_for('user_page', name='peter'))
-    print(url_for('test_url_for'))
+    print(url_for('main.user_page', name='greyli'))  # 输出：/user/greyli
+    print(url_for('main.user_page', name='peter'))
+    print(url_for('main.test_url_for'))
 
     # 下面这个调用传入了多余的关键字参数，它们会被作为查询字符串附加到URL后面
-    print(url_for('test_url_for', num=2))
+    print(url_for('main.test_url_for', num=2))
     return 'Test page'
 
 
 # 登录
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -95,32 +173,49 @@ def login():
 
         if not username or not password:
             flash('Invalid input.')
-            return redirect(url_for('login'))
-
-        user = User.query.first()
+            return redirect(url_for('main.login'))
+
+        # 在计算密码散列之前按 IP 和用户名限流，大量尝试不会占满 CPU
+        per_minute = current_app.config['WATCHLIST_LOGIN_PER_MINUTE']
+        if per_minute > 0:
+            wait = login_limiter.acquire([('ip', request.remote_addr), ('username', username.lower())],
+                                         rate=per_minute / 60, burst=current_app.config['WATCHLIST_LOGIN_BURST'])
+            if wait:
+                flash('Too many login attempts, please try again later.')
+                return render_template('login.html'), 429, {'Retry-After': str(math.ceil(wait))}
+
+        user = User.query.filter_by(username=username).first()
         # 验证用户名和密码是否一致
-        if username == user.username and user.validate_password(password):
+        valid = False
+        if user is not None:
+            with timer('password_verify'):
+                valid = user.validate_password(password)
+        if valid:
+            if user.needs_rehash():    # 散列参数已修改，用新参数重新散列
+                with timer('password_hash'):
+                    user.set_password(password)
+                db.session.commit()
             login_user(user)    # 登录用户
             flash('Login success.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
 
         flash('Invalid username or password.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('login.html')
 
 
 # 登出
-@app.route('/logout')
+@bp.route('/logout')
 @login_required    # 用于视图保护
 def logout():
     logout_user()
     flash('Goodbye.')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
 # 设置页面，支持修改用户的名字
-@app.route('/settings', methods=['GET', 'POST'])
+@bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     if request.method == 'POST':
@@ -128,15 +223,15 @@ def settings():
 
         if not name or len(name) > 20:
             flash('Invalid input.')
-            return redirect(url_for('settings'))
+            return redirect(url_for('main.settings'))
 
-        current_user.name = name
-        # current_user 会返回当前登录用户的数据库记录对象
-        # 等同于下面的用法
-        # user = User.query.first()
-        # user.name = name
+        # current_user 是缓存的用户资料快照，修改时要查询数据库记录
+        user = db.session.get(User, current_user.id)
+        user.name = name
+        bump_version(current_user.id)  # 页面标题中显示了名字
         db.session.commit()
-        flash('Setting updated.')
-        return redirect(url_for('index'))
+        invalidate_profiles()   # 使缓存的用户资料失效
+        flash('Settings updated.')
+        return redirect(url_for('main.index'))
 
     return render_template('settings.html')
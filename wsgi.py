@@ -8,4 +8,6 @@ dotenv_path = \
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path)
 
-from watchlist import app
\ No newline at end of file
+from watchlist import create_app
+
+app = create_app()
\ No newline at end of file